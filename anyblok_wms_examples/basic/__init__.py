@@ -7,11 +7,40 @@
 # v. 2.0. If a copy of the MPL was not distributed with this file,You can
 # obtain one at http://mozilla.org/MPL/2.0/.
 from anyblok.blok import Blok
+from anyblok.config import Configuration
+
 from .. import version
+from .config import DEFAULT_PACK_SIZES
+from .config import DEFAULT_PRODUCTS
+
+BULK_CHUNK_SIZE = 5000
+"""Maximum number of rows in a single multi-row ``INSERT``."""
+
+
+def product_code(index):
+    """Code of the product of the given index in the catalogue.
+
+    The first 400 products make the original 20x20 grid of jeans sizes.
+    """
+    return "JEANS/%d/%d" % (25 + index // 20, 20 + index % 20)
+
+
+def pack_code(product, position, size):
+    """Code of the pack Type of ``size`` items of ``product``.
+
+    :param int position: rank of ``size`` in the configured pack sizes
+    """
+    if position == 0:
+        return product + '/PCK'
+    return '%s/PCK%d' % (product, size)
 
 
 class Seller(Blok):
-    """A very crude scenario of arrivals and departures."""
+    """A very crude scenario of arrivals and departures.
+
+    The catalogue size, the pack sizes and the location tree are install
+    time parameters, see the :mod:`config <.config>` module.
+    """
 
     version = version
     author = 'Georges Racinet'
@@ -20,6 +49,9 @@ class Seller(Blok):
 
     def install(self):
         Wms = self.registry.Wms
+        # must be done before any PhysObj Type gets created
+        Wms.Worker.install_triggers()
+        Wms.Example.StockLevel.install_triggers()
         POT = Wms.PhysObj.Type
         Apparition = Wms.Operation.Apparition
         loc_type = POT.insert(code="LOCATION",
@@ -29,32 +61,123 @@ class Seller(Blok):
         for loc_code in ('incoming', 'stock', 'outgoing'):
             Apparition.create(state='done', location=root, quantity=1,
                               goods_type=loc_type, goods_code=loc_code)
+        self.install_location_tree(
+            root, loc_type,
+            Configuration.get('wms_example_zones') or 0,
+            Configuration.get('wms_example_aisles') or 0,
+            Configuration.get('wms_example_bins') or 0)
+        self.install_catalogue(
+            Configuration.get('wms_example_products', DEFAULT_PRODUCTS),
+            Configuration.get('wms_example_pack_sizes') or DEFAULT_PACK_SIZES)
 
-        for width in range(25, 45):
-            for height in range(20, 40):
-                product = "JEANS/%d/%d" % (width, height)
-                jeans = POT.insert(code=product, product=product)
-                POT.insert(
-                    code=product + '/PCK',
-                    product=product,
-                    behaviours=dict(
-                        unpack=dict(
-                            uniform_outcomes=True,
-                            outcomes=[dict(type=jeans.code, quantity=20)]
-                        )
-                    )
-                )
+    def bulk_insert(self, model, rows, returning=()):
+        """Insert rows with multi-row ``INSERT`` statements.
+
+        :param returning: names of columns to return
+        :return: list of returned rows, if ``returning`` is specified
+        """
+        table = model.__table__
+        returned = []
+        for start in range(0, len(rows), BULK_CHUNK_SIZE):
+            query = table.insert().values(rows[start:start + BULK_CHUNK_SIZE])
+            if returning:
+                query = query.returning(*(table.c[col] for col in returning))
+                returned.extend(self.registry.execute(query).fetchall())
+            else:
+                self.registry.execute(query)
+        return returned
+
+    def install_catalogue(self, products, pack_sizes):
+        """Create the goods and pack Types of ``products`` products in bulk.
+
+        Bulk inserts bypass the ORM, but the StockLevel triggers still
+        apply, and the in-memory Type indexes are explicitly invalidated.
+        """
+        POT = self.registry.Wms.PhysObj.Type
+        codes = [product_code(index) for index in range(products)]
+        self.bulk_insert(POT, [dict(code=product, product=product)
+                               for product in codes])
+        # separate statement: all rows of a multi-row INSERT must have
+        # the same columns
+        self.bulk_insert(POT, [
+            dict(code=pack_code(product, position, size),
+                 product=product,
+                 behaviours=dict(unpack=dict(
+                     uniform_outcomes=True,
+                     outcomes=[dict(type=product, quantity=size)])))
+            for product in codes
+            for position, size in enumerate(pack_sizes)])
+        POT.invalidate_code_index()
+
+    def install_location_tree(self, root, loc_type, zones, aisles, bins):
+        """Create zones, aisles in zones, and bins in aisles, in bulk.
+
+        All their Avatars have a single Apparition of zero quantity as
+        reason.
+        """
+        if not zones:
+            return
+        Wms = self.registry.Wms
+        reason = Wms.Operation.Apparition.create(
+            state='done', location=root, quantity=0, goods_type=loc_type)
+        level = self.insert_locations(
+            {root.id: ''}, zones, 'Z%d', loc_type, reason)
+        if aisles:
+            level = self.insert_locations(level, aisles, '-A%d', loc_type,
+                                          reason)
+            if bins:
+                self.insert_locations(level, bins, '-B%d', loc_type, reason)
+
+    def insert_locations(self, parents, count, code_fmt, loc_type, reason):
+        """Insert ``count`` locations in each of the ``parents``.
+
+        :param parents: dict whose keys are ids of parent locations, and
+                        values their codes, used as prefixes.
+        :param code_fmt: format of the code suffix, applied on the position
+                         of the location in its parent, starting from 1.
+        :return: the created locations, in the same format as ``parents``
+        """
+        PhysObj = self.registry.Wms.PhysObj
+        codes = {}
+        for parent_id, parent_code in parents.items():
+            for position in range(1, count + 1):
+                codes[parent_code + code_fmt % position] = parent_id
+        created = dict(self.bulk_insert(
+            PhysObj,
+            [dict(type_id=loc_type.id, code=code) for code in codes],
+            returning=('id', 'code')))
+        self.bulk_insert(PhysObj.Avatar,
+                         [dict(obj_id=obj_id,
+                               location_id=codes[code],
+                               state='present',
+                               dt_from=reason.dt_execution,
+                               reason_id=reason.id)
+                          for obj_id, code in created.items()])
+        return created
 
     def update(self, latest_version):
         if latest_version is None:
             self.install()
+            return
+        # the version number didn't change when StockLevel got introduced,
+        # hence we have to look at the triggers themselves
+        Wms = self.registry.Wms
+        StockLevel = Wms.Example.StockLevel
+        rebuild = not StockLevel.triggers_installed()
+        # these are idempotent, and pick up changes in trigger functions
+        Wms.Worker.install_triggers()
+        StockLevel.install_triggers()
+        if rebuild:
+            StockLevel.rebuild()
 
     @classmethod
     def import_declaration_module(cls):
         from . import ns # noqa
         from . import util # noqa
         from . import sale # noqa
+        from . import staging # noqa
         from . import goods # noqa
+        from . import stock_level # noqa
         from . import arrival # noqa
         from . import departure # noqa
         from . import regular_worker # noqa
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Examples project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""Microbenchmarks of the worker methods, at several data sizes.
+
+They are not collected by the regular test runs. To run them, pass
+their module explicitly, with a method name pattern matching them::
+
+  nosetests --with-anyblok-bloks -m '^bench_' \\
+      anyblok_wms_examples/basic/benchmarks/bench_workers.py
+
+The following environment variables are taken into account:
+
+- ``WMS_BENCH_SIZES``: comma separated numbers of Avatars to create
+  before measuring, default ``0,10000``,
+- ``WMS_BENCH_ROUNDS``: number of measured calls, default ``20``,
+- ``WMS_BENCH_OUTPUT``: path of the JSON results file, defaults to
+  ``wms-bench-<git revision>.json`` in the current directory.
+
+Two results files can then be compared with ``wms_example_bench_compare``.
+"""
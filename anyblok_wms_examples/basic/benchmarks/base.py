@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Examples project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import json
+import logging
+import os
+import statistics
+import subprocess
+import time
+from datetime import datetime
+
+from anyblok_wms_base.testing import WmsTestCase
+
+logger = logging.getLogger(__name__)
+
+BENCH_SIZES = [int(size) for size in
+               os.environ.get('WMS_BENCH_SIZES', '0,10000').split(',')]
+"""Numbers of Avatars to create before measuring, in increasing order."""
+
+BENCH_ROUNDS = int(os.environ.get('WMS_BENCH_ROUNDS', 20))
+
+
+def git_revision():
+    """Return the git revision of the source tree, or ``None``."""
+    try:
+        return subprocess.check_output(
+            ('git', 'rev-parse', 'HEAD'),
+            cwd=os.path.dirname(__file__),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def results_path(revision):
+    path = os.environ.get('WMS_BENCH_OUTPUT')
+    if path is not None:
+        return path
+    return 'wms-bench-%s.json' % (revision or 'unknown')[:12]
+
+
+def timing_stats(durations):
+    """Summarize the durations of the rounds of a benchmark, in seconds."""
+    mean = statistics.mean(durations)
+    return dict(rounds=len(durations),
+                min=min(durations),
+                max=max(durations),
+                mean=mean,
+                median=statistics.median(durations),
+                stddev=(statistics.stdev(durations)
+                        if len(durations) > 1 else 0.),
+                ops=1 / mean if mean else None)
+
+
+def record(size, name, durations):
+    """Add the results of a benchmark to the JSON results file.
+
+    The file is rewritten from scratch if it's for another revision.
+    """
+    revision = git_revision()
+    path = results_path(revision)
+    results = None
+    if os.path.exists(path):
+        with open(path) as results_file:
+            results = json.load(results_file)
+        if results.get('revision') != revision:
+            results = None
+    if results is None:
+        results = dict(revision=revision, results={})
+    results['date'] = datetime.now().isoformat()
+    results['results'].setdefault(str(size), {})[name] = timing_stats(
+        durations)
+    with open(path, 'w') as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+
+
+class BenchmarkCase(WmsTestCase):
+    """Base class for benchmarks.
+
+    Each benchmark method runs in a single transaction, which is rolled
+    back at the end, as for tests. It should iterate over :meth:`sizes`
+    and call :meth:`measure` for each of them.
+    """
+
+    rounds = BENCH_ROUNDS
+
+    def setUp(self):
+        super().setUp()
+        Wms = self.Wms = self.registry.Wms
+        self.StockLevel = Wms.Example.StockLevel
+        self.products = Wms.PhysObj.Type.all_products()
+        self.size = None
+
+    def sizes(self, missing=0):
+        """Grow the database to each of the data sizes, and yield them.
+
+        Data sizes are numbers of Avatars, created by
+        :meth:`StockLevel.seed() <.stock_level.StockLevel.seed>`.
+        Since the sizes are in increasing order, this is incremental.
+
+        :param int missing: number of products that are left without stock
+        """
+        seeded = self.products[:len(self.products) - missing]
+        for size in BENCH_SIZES:
+            start = time.time()
+            if size and seeded:
+                self.StockLevel.seed(-(-size // len(seeded)),
+                                     products=seeded)
+                self.registry.flush()
+            logger.info("%s: grew to size %d in %.3f seconds",
+                        self.id(), size, time.time() - start)
+            self.size = size
+            yield size
+
+    def measure(self, name, func, setup=None, rounds=None):
+        """Measure ``rounds`` calls of ``func`` and record the results.
+
+        The ORM session is flushed after each call, within the measured
+        time, so that the cost of pending SQL statements is included.
+
+        :param setup: if specified, it is called before each round, outside
+                      of the measured time, and must return a tuple of
+                      arguments for ``func``.
+        :return: list of results of ``func``
+        """
+        if rounds is None:
+            rounds = self.rounds
+        flush = self.registry.flush
+        durations = []
+        results = []
+        for _ in range(rounds):
+            args = setup() if setup is not None else ()
+            flush()
+            start = time.perf_counter()
+            results.append(func(*args))
+            flush()
+            durations.append(time.perf_counter() - start)
+        record(self.size, name, durations)
+        logger.info("%s at size %s: median %.6f seconds",
+                    name, self.size, statistics.median(durations))
+        return results
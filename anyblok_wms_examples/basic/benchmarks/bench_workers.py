@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Examples project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+from functools import partial
+
+from .base import BENCH_SIZES
+from .base import BenchmarkCase
+
+
+class WorkersBenchmark(BenchmarkCase):
+
+    def setUp(self):
+        super().setUp()
+        Wms = self.Wms
+        self.Sale = Wms.Example.Sale
+        self.Request = Wms.Reservation.Request
+        self.regular = Wms.Worker.Regular.insert()
+        self.planner = Wms.Worker.Planner.insert()
+
+    def missing_sizes(self):
+        """Sizes with enough missing products for one purchase per round."""
+        return self.sizes(missing=self.rounds * len(BENCH_SIZES))
+
+    def purchase(self, count):
+        """Issue ``count`` purchases, for the current timeslice.
+
+        :return: the pack codes
+        """
+        self.regular.done_timeslice = 0
+        return [self.regular.purchase() for _ in range(count)]
+
+    def unfolded(self, req_id):
+        """Arguments for :meth:`plan_claimed`: Request id and Reservations.
+
+        The Request is marked as planned right away, as
+        ``Planner.plan_request()`` would do.
+        """
+        req, resas = self.planner.unfold_request(req_id)
+        req.planned = True
+        return req_id, resas
+
+    def plan_claimed(self, plan, req_id, *args):
+        """Call ``plan`` with the Reservations of a Request claimed.
+
+        This is what the Planner does, and Operations can't be created
+        on reserved PhysObj otherwise.
+        """
+        with self.Request.claim_reservations(id=req_id) as claimed:
+            assert claimed == req_id
+            return plan(*args)
+
+    def bench_sale_create(self):
+        contents = {product: 1 for product in self.products[:3]}
+        for _ in self.sizes():
+            self.measure('Sale.create', self.Sale.create, setup=lambda: (
+                contents, ))
+
+    def bench_purchase(self):
+        for _ in self.missing_sizes():
+            self.measure('Regular.purchase', self.regular.purchase)
+
+    def bench_process_arrival(self):
+        for _ in self.missing_sizes():
+            self.purchase(self.rounds)
+            # now the Arrivals are due
+            self.regular.done_timeslice = 10
+            self.measure('Regular.process_arrival',
+                         self.regular.process_arrival)
+
+    def bench_select_ready_operation(self):
+        for _ in self.missing_sizes():
+            self.purchase(self.rounds)
+            self.regular.done_timeslice = 10
+            while self.regular.process_arrival():
+                pass
+            # Moves of arrived packs are ready, their Unpacks are not
+            while self.planner.process_one():
+                pass
+            self.measure('Regular.select_ready_operation',
+                         lambda: self.regular.select_ready_operation(
+                             fresh_snapshot=False))
+
+    def bench_plan_unpack(self):
+        planner = self.planner
+        for _ in self.missing_sizes():
+            self.purchase(self.rounds)
+            # all unplanned Requests are for unpacking purchased packs
+            req_ids = iter(r[0] for r in self.Request.query('id').filter_by(
+                planned=False).order_by(self.Request.id).all())
+            self.measure('Planner.plan_unpack',
+                         partial(self.plan_claimed, planner.plan_unpack),
+                         setup=lambda: self.unfolded(next(req_ids)))
+
+    def bench_plan_delivery(self):
+        planner = self.planner
+        products = self.products[:self.rounds]
+
+        def setup():
+            sale, req = self.Sale.create({next(ordered): 1})
+            req.reserve()
+            return self.unfolded(req.id) + (sale.id, )
+
+        per_product = 1 + self.rounds // len(products)
+        StockLevel = self.StockLevel
+        for _ in self.sizes():
+            # enough unreserved goods, whatever happened at previous sizes
+            StockLevel.seed(
+                per_product + max(StockLevel.query().get(product).quantity
+                                  for product in products),
+                products=products)
+            ordered = iter(products * per_product)
+            self.measure('Planner.plan_delivery',
+                         partial(self.plan_claimed, planner.plan_delivery),
+                         setup=setup)
+
+    def bench_missing_product_query(self):
+        query = self.regular.missing_product_query()
+        execute = self.registry.execute
+        for _ in self.missing_sizes():
+            self.measure('Regular.missing_product_query',
+                         lambda: execute(query).fetchall())
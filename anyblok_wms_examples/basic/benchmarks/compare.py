@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Examples project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""Comparison of two benchmark results files."""
+import json
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+
+def compare(before, after, stat='median'):
+    """Compare two benchmark results, as loaded from JSON files.
+
+    :return: sorted list of ``(size, name, before, after, ratio)``, for
+             benchmarks present in both. ``ratio`` is ``after / before``
+             hence greater than 1 for a slowdown.
+    """
+    lines = []
+    for size, benchs in before['results'].items():
+        for name, stats in benchs.items():
+            other = after['results'].get(size, {}).get(name)
+            if other is None:
+                continue
+            ratio = other[stat] / stats[stat] if stats[stat] else None
+            lines.append((int(size), name, stats[stat], other[stat], ratio))
+    return sorted(lines)
+
+
+def run():
+    parser = ArgumentParser(
+        description="Compare two results files of the benchmarks",
+        formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--stat", default='median',
+                        choices=('min', 'max', 'mean', 'median'))
+    arguments = parser.parse_args()
+    with open(arguments.before) as before_file:
+        before = json.load(before_file)
+    with open(arguments.after) as after_file:
+        after = json.load(after_file)
+
+    print("Comparing %s (%s) to %s (%s)" % (
+        arguments.before, (before.get('revision') or '?')[:12],
+        arguments.after, (after.get('revision') or '?')[:12]))
+    for size, name, before_t, after_t, ratio in compare(
+            before, after, stat=arguments.stat):
+        print("%8d %-32s %10.6fs %10.6fs %s" % (
+            size, name, before_t, after_t,
+            '' if ratio is None else '%.2fx' % ratio))
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Examples project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""Install time parameters of the Seller blok."""
+from argparse import ArgumentTypeError
+
+from anyblok.config import Configuration
+
+DEFAULT_PRODUCTS = 400
+"""Default catalogue size, matching the original 20x20 jeans grid."""
+
+DEFAULT_PACK_SIZES = (20, )
+
+
+def parse_pack_sizes(value):
+    """Parse a comma separated list of positive integers."""
+    try:
+        sizes = tuple(int(size) for size in value.split(','))
+    except ValueError:
+        raise ArgumentTypeError("Not a list of integers: %r" % value)
+    if not sizes or min(sizes) < 1:
+        raise ArgumentTypeError("Pack sizes must be positive: %r" % value)
+    return sizes
+
+
+@Configuration.add('wms-example-seller',
+                   label="WMS Examples, catalogue and locations of the "
+                   "Seller blok (install time)",
+                   must_be_loaded_by_unittest=True)
+def define_seller_install(group):
+    group.add_argument('--wms-example-products', dest='wms_example_products',
+                       type=int, default=DEFAULT_PRODUCTS,
+                       help="Number of products in the catalogue")
+    group.add_argument('--wms-example-pack-sizes',
+                       dest='wms_example_pack_sizes',
+                       type=parse_pack_sizes,
+                       default=','.join(str(s) for s in DEFAULT_PACK_SIZES),
+                       help="Comma separated quantities of the pack Types "
+                       "of each product. Purchases are made with the first "
+                       "one")
+    group.add_argument('--wms-example-zones', dest='wms_example_zones',
+                       type=int, default=0,
+                       help="Number of zones in the warehouse")
+    group.add_argument('--wms-example-aisles', dest='wms_example_aisles',
+                       type=int, default=0,
+                       help="Number of aisles in each zone")
+    group.add_argument('--wms-example-bins', dest='wms_example_bins',
+                       type=int, default=0,
+                       help="Number of bins in each aisle")
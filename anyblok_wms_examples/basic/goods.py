@@ -6,9 +6,15 @@
 # This Source Code Form is subject to the terms of the Mozilla Public License,
 # v. 2.0. If a copy of the MPL was not distributed with this file,You can
 # obtain one at http://mozilla.org/MPL/2.0/.
+import logging
+
+from sqlalchemy import event
+
 from anyblok import Declarations
 from anyblok.column import String
 
+logger = logging.getLogger(__name__)
+
 Model = Declarations.Model
 Mixin = Declarations.Model
 register = Declarations.register
@@ -18,3 +24,125 @@ register = Declarations.register
 class Type:
     product = String(index=True)
     """Common reference shared between deliverable Goods and their packs."""
+
+    _code_index = {}
+    """Cache of Type ids, by database name, then by code.
+
+    The catalogue is created at installation time, therefore it's enough
+    to build it once per process, and to discard it if some new Type
+    gets inserted. This is done by :meth:`after_insert_orm_event`, and
+    again at the next rollback, since the index may have been rebuilt
+    in the meanwhile with the inserted Type.
+
+    Types created by other processes are not known to the cache, hence
+    lookups that miss it fall back to a query.
+    """
+
+    _pack_index = {}
+    """Cache of pack Type ids, by database name, then by product.
+
+    If a product has several pack Types, the first created one is used.
+    """
+
+    _products = {}
+    """Cache of sorted lists of products, by database name."""
+
+    _invalidate_on_rollback = set()
+    """Database names for which the indexes will be discarded at rollback."""
+
+    @classmethod
+    def build_code_index(cls):
+        """Build the in-memory indexes for the current database.
+
+        This is done with a single query over the whole catalogue.
+        """
+        db_name = cls.registry.db_name
+        codes = {}
+        packs = {}
+        products = set()
+        for type_id, code, product, behaviours in cls.query(
+                'id', 'code', 'product', 'behaviours').order_by(
+                    cls.id).all():
+            codes[code] = type_id
+            if product is not None:
+                products.add(product)
+            if product is not None and behaviours and 'unpack' in behaviours:
+                packs.setdefault(product, type_id)
+        logger.info("Built PhysObj Type index for %d codes and %d packs",
+                    len(codes), len(packs))
+        cls._code_index[db_name] = codes
+        cls._pack_index[db_name] = packs
+        cls._products[db_name] = sorted(products)
+
+    @classmethod
+    def invalidate_code_index(cls):
+        """Discard the in-memory indexes for the current database."""
+        db_name = cls.registry.db_name
+        cls._code_index.pop(db_name, None)
+        cls._pack_index.pop(db_name, None)
+        cls._products.pop(db_name, None)
+
+    @classmethod
+    def after_insert_orm_event(cls, mapper, connection, target):
+        cls.invalidate_code_index()
+        db_name = cls.registry.db_name
+        if db_name in cls._invalidate_on_rollback:
+            return
+
+        def after_soft_rollback(session, previous_transaction):
+            cls._invalidate_on_rollback.discard(db_name)
+            cls.invalidate_code_index()
+
+        cls._invalidate_on_rollback.add(db_name)
+        event.listen(cls.registry.session, 'after_soft_rollback',
+                     after_soft_rollback, once=True)
+
+    @classmethod
+    def id_by_code(cls, code):
+        """Return the id of the Type having the given code.
+
+        :raises: KeyError if there's no such Type
+        """
+        codes = cls._code_index.get(cls.registry.db_name)
+        if codes is None:
+            cls.build_code_index()
+            codes = cls._code_index[cls.registry.db_name]
+        type_id = codes.get(code)
+        if type_id is None:
+            type_id = cls.query('id').filter_by(code=code).scalar()
+            if type_id is None:
+                raise KeyError(code)
+            codes[code] = type_id
+        return type_id
+
+    @classmethod
+    def pack_id_by_product(cls, product):
+        """Return the id of the pack Type for the given product.
+
+        :raises: KeyError if there's no such Type
+        """
+        packs = cls._pack_index.get(cls.registry.db_name)
+        if packs is None:
+            cls.build_code_index()
+            packs = cls._pack_index[cls.registry.db_name]
+        pack_id = packs.get(product)
+        if pack_id is None:
+            pack_id = next(
+                (type_id for type_id, behaviours in cls.query(
+                    'id', 'behaviours').filter_by(product=product).order_by(
+                        cls.id).all()
+                 if behaviours and 'unpack' in behaviours),
+                None)
+            if pack_id is None:
+                raise KeyError(product)
+            packs[product] = pack_id
+        return pack_id
+
+    @classmethod
+    def all_products(cls):
+        """Return the sorted list of all products."""
+        products = cls._products.get(cls.registry.db_name)
+        if products is None:
+            cls.build_code_index()
+            products = cls._products[cls.registry.db_name]
+        return products
@@ -7,7 +7,11 @@
 # v. 2.0. If a copy of the MPL was not distributed with this file,You can
 # obtain one at http://mozilla.org/MPL/2.0/.
 import logging
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+
+from sqlalchemy import and_
+
 from anyblok import Declarations
 
 logger = logging.getLogger(__name__)
@@ -34,56 +38,157 @@ class Planner(Mixin.WmsBasicSellerUtil):
             Reservation.request_item).filter(RequestItem.request == req).all()
         return req, resas
 
+    @classmethod
+    @contextmanager
+    def claim_requests(cls, count):
+        """Claim ownership over up to ``count`` unplanned Requests at once.
+
+        This is the batch counterpart of
+        :meth:`Request.claim_reservations`, with the same ``SKIP LOCKED``
+        locking.
+
+        :return: list of claimed Request ids
+        """
+        Request = cls.registry.Wms.Reservation.Request
+        req_ids = [r[0] for r in Request.query('id').filter_by(
+            reserved=True, planned=False).with_for_update(
+                skip_locked=True, of=Request).order_by(
+                    Request.id).limit(count).all()]
+        Request.txn_owned_reservations.update(req_ids)
+        try:
+            yield req_ids
+        finally:
+            Request.txn_owned_reservations.difference_update(req_ids)
+
+    def unfold_requests(self, req_ids):
+        """Load Requests, their Reservations and current Avatars at once.
+
+        This is done in a single query. Requests without any
+        Reservation are part of the result.
+
+        :return: list of ``(Request, [Reservation], [Avatar])``, in the
+                 order of Request ids. The Avatars are those of the
+                 reserved PhysObj, in the same order as the Reservations.
+        """
+        Wms = self.registry.Wms
+        Reservation = Wms.Reservation
+        Request = Reservation.Request
+        RequestItem = Reservation.RequestItem
+        Avatar = Wms.PhysObj.Avatar
+        query = self.registry.query(Request, Reservation, Avatar).outerjoin(
+            RequestItem, RequestItem.request_id == Request.id).outerjoin(
+                Reservation,
+                Reservation.request_item_id == RequestItem.id).outerjoin(
+                    Avatar, and_(Avatar.obj_id == Reservation.physobj_id,
+                                 Avatar.dt_until.is_(None))).filter(
+                    Request.id.in_(req_ids)).order_by(Request.id,
+                                                      Reservation.physobj_id)
+        unfolded = []
+        for req, resa, avatar in query.all():
+            if not unfolded or unfolded[-1][0] is not req:
+                unfolded.append((req, [], []))
+            if resa is not None:
+                unfolded[-1][1].append(resa)
+                unfolded[-1][2].append(avatar)
+        return unfolded
+
     def process_one(self, self_str=None):
+        if self.batch_size is not None and self.batch_size > 1:
+            return self.process_batch(self_str=self_str)
         Reservation = self.registry.Wms.Reservation
         Request = Reservation.Request
         with Request.claim_reservations(planned=False) as req_id:
             if req_id is None:
                 return False
             req, resas = self.unfold_request(req_id)
-            purpose = req.purpose
             logger.info("%s, claimed reservation id=%d (purpose=%r)",
-                        self_str, req_id, purpose)
-            if purpose == 'unpack':
-                self.plan_unpack(resas)
-            elif isinstance(purpose, list) and purpose[0] == 'sale':
-                self.plan_delivery(resas, purpose[1])
-            req.planned = True
+                        self_str, req_id, req.purpose)
+            self.plan_request(req, resas)
             return True
 
-    def plan_unpack(self, resas):
-        Wms = self.registry.Wms
-        Avatar = Wms.PhysObj.Avatar
-        Operation = Wms.Operation
-        for resa in resas:
-            # TODO use eventual_avatar()
-            avatar = Avatar.query().filter_by(obj=resa.physobj,
-                                              dt_until=None).one()
-            dt = datetime.now() + timedelta(minutes=10)
-            move = Operation.Move.create(input=avatar,
-                                         dt_execution=dt,
-                                         destination=self.stock_location)
-            moved = move.outcomes[0]
-            Operation.Unpack.create(
-                input=moved,
-                dt_execution=dt + timedelta(minutes=10)
-            )
-
-    def plan_delivery(self, resas, sale_id):
-        Wms = self.registry.Wms
-        Avatar = Wms.PhysObj.Avatar
-        Operation = Wms.Operation
-        for resa in resas:
-            # TODO use eventual_avatar()
-            avatar = Avatar.query().filter_by(goods=resa.goods,
-                                              dt_until=None).one()
-            dt = datetime.now() + timedelta(minutes=10)
-            move = Operation.Move.create(input=avatar,
-                                         dt_execution=dt,
-                                         destination=self.outgoing_location)
-            moved = move.outcomes[0]
-            Operation.Departure.create(
-                input=moved,
-                dt_execution=dt + timedelta(minutes=10),
-                sale_id=sale_id,
-            )
+    def process_batch(self, self_str=None):
+        """Claim up to :attr:`batch_size` Requests and plan them all.
+
+        :return: number of planned Requests
+        """
+        with self.claim_requests(self.batch_size) as req_ids:
+            if not req_ids:
+                return False
+            logger.info("%s, claimed %d reservation requests",
+                        self_str, len(req_ids))
+            dt_execution = datetime.now() + timedelta(minutes=10)
+            for req, resas, avatars in self.unfold_requests(req_ids):
+                self.plan_request(req, resas, avatars=avatars,
+                                  dt_execution=dt_execution)
+            return len(req_ids)
+
+    def plan_request(self, req, resas, avatars=None, dt_execution=None):
+        """Plan the Operations fulfilling the purpose of the given Request.
+
+        :param avatars: if specified, the current Avatars of the PhysObj
+                        of ``resas``, in the same order.
+        :param dt_execution: see :meth:`plan_moves`
+        """
+        purpose = req.purpose
+        if purpose == 'unpack':
+            self.plan_unpack(resas, avatars=avatars,
+                             dt_execution=dt_execution)
+        elif isinstance(purpose, list) and purpose[0] == 'sale':
+            self.plan_delivery(resas, purpose[1], avatars=avatars,
+                               dt_execution=dt_execution)
+        req.planned = True
+
+    def current_avatars(self, resas):
+        """Fetch the current Avatars of all reserved PhysObj in one query.
+
+        :return: list of Avatars, in the same order as ``resas``
+        """
+        if not resas:
+            return []
+        Avatar = self.registry.Wms.PhysObj.Avatar
+        by_obj = {av.obj_id: av for av in Avatar.query().filter(
+            Avatar.obj_id.in_(set(resa.physobj_id for resa in resas)),
+            Avatar.dt_until.is_(None)).all()}
+        return [by_obj[resa.physobj_id] for resa in resas]
+
+    def plan_moves(self, resas, destination, avatars=None,
+                   dt_execution=None):
+        """Plan Moves of all reserved PhysObj to the given destination.
+
+        :param avatars: if not specified, they are fetched with
+                        :meth:`current_avatars`.
+        :param dt_execution: planned execution time for all the Moves.
+                             If not specified, it is computed once for all.
+        :return: the outcomes of the Moves, in the same order as ``resas``
+        """
+        Move = self.registry.Wms.Operation.Move
+        if avatars is None:
+            avatars = self.current_avatars(resas)
+        if dt_execution is None:
+            dt_execution = datetime.now() + timedelta(minutes=10)
+        return [Move.create(input=avatar,
+                            dt_execution=dt_execution,
+                            destination=destination).outcomes[0]
+                for avatar in avatars]
+
+    def plan_unpack(self, resas, avatars=None, dt_execution=None):
+        Unpack = self.registry.Wms.Operation.Unpack
+        if dt_execution is None:
+            dt_execution = datetime.now() + timedelta(minutes=10)
+        dt_unpack = dt_execution + timedelta(minutes=10)
+        for moved in self.plan_moves(resas, self.stock_location,
+                                     avatars=avatars,
+                                     dt_execution=dt_execution):
+            Unpack.create(input=moved, dt_execution=dt_unpack)
+
+    def plan_delivery(self, resas, sale_id, avatars=None, dt_execution=None):
+        Departure = self.registry.Wms.Operation.Departure
+        if dt_execution is None:
+            dt_execution = datetime.now() + timedelta(minutes=10)
+        dt_departure = dt_execution + timedelta(minutes=10)
+        for moved in self.plan_moves(resas, self.outgoing_location,
+                                     avatars=avatars,
+                                     dt_execution=dt_execution):
+            Departure.create(input=moved,
+                             dt_execution=dt_departure,
+                             sale_id=sale_id)
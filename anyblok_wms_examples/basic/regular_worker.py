@@ -7,10 +7,16 @@
 # v. 2.0. If a copy of the MPL was not distributed with this file,You can
 # obtain one at http://mozilla.org/MPL/2.0/.
 import logging
+import time
 from datetime import datetime, timedelta
 
+from sqlalchemy import and_
+from sqlalchemy import exists
+
 from anyblok import Declarations
 
+from ..workload import Workload
+
 logger = logging.getLogger(__name__)
 
 Model = Declarations.Model
@@ -26,6 +32,23 @@ class Regular(Mixin.WmsBasicSellerUtil):
     def missing_product_query(cls):
         """A query for product that's entirely missing.
 
+        This is an indexed lookup in the incrementally maintained
+        :class:`StockLevel <.stock_level.StockLevel>` table.
+        """
+        return """
+        SELECT product FROM wms_example_stocklevel
+        WHERE quantity = 0
+        """.strip()
+
+    @classmethod
+    def missing_product_full_query(cls):
+        """A query for product that's entirely missing, from scratch.
+
+        This was the implementation of :meth:`missing_product_query` before
+        the introduction of
+        :class:`StockLevel <.stock_level.StockLevel>`, and is kept
+        for consistency checks.
+
         For now, a pure SQL query, to be converted into proper SQLAlchemy
         later. It is probably more efficient than using the quantity queries
         because the DISTINCT ON avoids fetching all matching avatars.
@@ -68,12 +91,12 @@ class Regular(Mixin.WmsBasicSellerUtil):
         if not products:
             return False
 
-        pack_codes = [r[0] + '/PCK' for r in products]
-
         Wms = self.registry.Wms
         GoodsType = Wms.PhysObj.Type
+        pack_ids = [GoodsType.pack_id_by_product(r[0]) for r in products]
+
         pack_type = GoodsType.query().filter(
-            GoodsType.code.in_(pack_codes)).with_for_update(
+            GoodsType.id.in_(pack_ids)).with_for_update(
                 skip_locked=True).first()
         if pack_type is None:
             logger.info("No product missing that isn't taken care of by "
@@ -94,6 +117,161 @@ class Regular(Mixin.WmsBasicSellerUtil):
         self.reserve_for_unpack(arrival.outcomes[0].goods)
         return pack_type.code
 
+    def purchase_batch_size(self, missing):
+        """Number of packs this worker should order at once.
+
+        All active regular workers issue purchases at the beginning of
+        timeslices, hence each one should take its share.
+
+        :param int missing: number of missing products
+        """
+        cls = self.__class__
+        workers = cls.query().filter(cls.active.is_(True)).count()
+        return -(-missing // max(workers, 1))
+
+    def purchase_many(self):
+        """Issue Arrivals and unpack Reservations for many missing products.
+
+        This locks at once as many pack Types as given by
+        :meth:`purchase_batch_size` and issues all Arrivals in the same
+        transaction. The Reservations are inserted in bulk
+        by :meth:`reserve_for_unpack_many`.
+
+        :return: list of pack codes for which an Arrival is scheduled. It is
+                 empty if nothing is missing, or if all missing products
+                 are taken care of by other processes.
+        """
+        products = self.registry.execute(
+            self.missing_product_query()).fetchall()
+        if not products:
+            return []
+
+        GoodsType = self.registry.Wms.PhysObj.Type
+        pack_ids = [GoodsType.pack_id_by_product(r[0]) for r in products]
+        pack_types = GoodsType.query().filter(
+            GoodsType.id.in_(pack_ids)).with_for_update(
+                skip_locked=True).limit(
+                    self.purchase_batch_size(len(pack_ids))).all()
+        if not pack_types:
+            logger.info("No product missing that isn't taken care of by "
+                        "other processes")
+            return []
+
+        logger.info("%d products are missing, ordering packs for %d of them",
+                    len(pack_ids), len(pack_types))
+        self.order_packs(pack_types)
+        return [pack_type.code for pack_type in pack_types]
+
+    def order_packs(self, pack_types):
+        """Issue Arrivals for the given pack Types, and reserve them.
+
+        There's one Arrival for each item of ``pack_types``, which can
+        therefore contain duplicates. The unpack Reservations are inserted
+        in bulk by :meth:`reserve_for_unpack_many`.
+        """
+        Wms = self.registry.Wms
+        PhysObj = Wms.PhysObj
+        Avatar = PhysObj.Avatar
+        Arrival = Wms.Operation.Arrival
+        location = self.incoming_location
+        timeslice = self.current_timeslice + 2
+        dt_execution = datetime.now() + timedelta(minutes=10)
+        arrival_ids = [Arrival.create(goods_type=pack_type,
+                                      location=location,
+                                      timeslice=timeslice,
+                                      dt_execution=dt_execution).id
+                       for pack_type in pack_types]
+        self.reserve_for_unpack_many(self.registry.query(
+            PhysObj.id, PhysObj.type_id).join(
+                Avatar, Avatar.obj_id == PhysObj.id).filter(
+                    Avatar.reason_id.in_(arrival_ids)).all())
+
+    def purchase_scheduled(self):
+        """Issue the purchases of the workload feed for this timeslice.
+
+        These are on top of those of :meth:`purchase_many`, and don't lock
+        the pack Types.
+
+        Unknown products are skipped: failing would roll back the pulling
+        of the feed lines, hence pull them again at each timeslice.
+
+        :return: number of ordered packs
+        """
+        Wms = self.registry.Wms
+        GoodsType = Wms.PhysObj.Type
+        pack_types = []
+        for contents in Wms.Example.WorkloadStaging.pull(
+                self.feed_stream, self.feed_timeslice, 'purchase'):
+            for product, packs in contents.items():
+                try:
+                    pack_id = GoodsType.pack_id_by_product(product)
+                except KeyError:
+                    logger.error("%s, skipping scheduled purchase of %d "
+                                 "packs of unknown product %r",
+                                 self, packs, product)
+                    continue
+                pack_types.extend([GoodsType.query().get(pack_id)] * packs)
+        if pack_types:
+            self.order_packs(pack_types)
+        return len(pack_types)
+
+    def scheduled_sales(self):
+        """Pull the sales of the workload feed for this timeslice.
+
+        Sales involving unknown products are skipped, for the same reason
+        as in :meth:`purchase_scheduled`.
+
+        :return: list of Sale contents
+        """
+        Wms = self.registry.Wms
+        GoodsType = Wms.PhysObj.Type
+        sales = []
+        for contents in Wms.Example.WorkloadStaging.pull(
+                self.feed_stream, self.feed_timeslice, 'sale'):
+            try:
+                for product in contents:
+                    GoodsType.id_by_code(product)
+            except KeyError as exc:
+                logger.error("%s, skipping scheduled sale %r of unknown "
+                             "product %s", self, contents, exc)
+                continue
+            sales.append(contents)
+        return sales
+
+    @property
+    def feed_timeslice(self):
+        """Current timeslice, relative to the workload feed."""
+        return self.current_timeslice - self.feed_offset
+
+    def reserve_for_unpack_many(self, packs):
+        """Reserve many packs for future unpacking, in bulk.
+
+        This is the bulk version of :meth:`reserve_for_unpack`: one
+        multi-row ``INSERT`` is issued for each of the Request, RequestItem
+        and Reservation tables.
+
+        :param packs: list of ``(PhysObj id, Type id)`` pairs
+        """
+        if not packs:
+            return
+        execute = self.registry.execute
+        Reservation = self.registry.Wms.Reservation
+        Request = Reservation.Request
+        RequestItem = Reservation.RequestItem
+        req_ids = self.next_ids(Request, len(packs))
+        item_ids = self.next_ids(RequestItem, len(packs))
+        execute(Request.__table__.insert().values(
+            [dict(id=req_id, purpose="unpack", reserved=True, planned=False)
+             for req_id in req_ids]))
+        execute(RequestItem.__table__.insert().values(
+            [dict(id=item_id, request_id=req_id, goods_type_id=type_id,
+                  quantity=1)
+             for item_id, req_id, (_, type_id) in zip(item_ids, req_ids,
+                                                      packs)]))
+        execute(Reservation.__table__.insert().values(
+            [dict(physobj_id=obj_id, request_item_id=item_id, quantity=1)
+             for item_id, (obj_id, _) in zip(item_ids, packs)]))
+
     def reserve_for_unpack(self, pack):
         """Reserve a pack for future unpacking.
 
@@ -114,112 +292,274 @@ class Regular(Mixin.WmsBasicSellerUtil):
                 quantity=1),
             quantity=1)
 
-    def process_arrival(self):
+    def due_arrivals_query(self):
+        """Query to lock the due Arrivals, skipping those already locked.
+
+        Arrivals given up for the current timeslice are excluded.
+        """
         Arrival = self.registry.Wms.Operation.Arrival
-        arrival = Arrival.query().filter(
+        return self.without_given_up(Arrival.query().filter(
             Arrival.state == 'planned',
-            Arrival.timeslice <= self.current_timeslice).with_for_update(
-                skip_locked=True).first()
+            Arrival.timeslice <= self.current_timeslice)).with_for_update(
+                skip_locked=True)
+
+    def process_arrival(self):
+        arrival = self.due_arrivals_query().first()
         if not arrival:
             return False
+        self.pending_batch = [arrival.id]
         arrival.execute()
         return True
 
+    def process_arrivals(self, limit):
+        """Lock up to ``limit`` due Arrivals at once and execute them.
+
+        :return: number of executed Arrivals
+        """
+        arrivals = self.due_arrivals_query().limit(limit).all()
+        self.pending_batch = [arrival.id for arrival in arrivals]
+        dt_execution = datetime.now()
+        for arrival in arrivals:
+            arrival.execute(dt_execution=dt_execution)
+        return len(arrivals)
+
+    def execute_arrival(self, arrival_id):
+        """Lock and execute the given Arrival if it is still due.
+
+        This is used to retry Arrivals of a failed transaction.
+        """
+        Arrival = self.registry.Wms.Operation.Arrival
+        arrival = self.due_arrivals_query().filter(
+            Arrival.id == arrival_id).first()
+        if arrival is None:
+            return
+        arrival.execute()
+        return arrival.__registry_name__, arrival.id
+
     def begin_timeslice(self):
         self_str = str(self)
-        c = 0
+        batch = self.batch_size is not None and self.batch_size > 1
+        c = conflicts = 0
+        self.enter_phase('arrivals')
+        start = time.time()
         proceed = True
         while proceed:
             try:
-                proceed = self.process_arrival()
-                c += 1
+                if batch:
+                    done = self.process_arrivals(self.batch_size)
+                else:
+                    done = int(self.process_arrival())
                 self.registry.commit()
+                self.conflict_resolved()
+                self.pending_batch = ()
+                proceed = bool(done)
+                c += done
             except KeyboardInterrupt:
                 raise
-            except:
-                logger.exception("%s, exception in process_arrival()",
-                                 self_str)
-                self.registry.rollback()
+            except Exception as exc:
+                if self.is_conflict(exc):
+                    conflicts += 1
+                proceed, retried = self.handle_pending_failure(
+                    exc, self_str, 'arrivals', execute=self.execute_arrival)
+                c += len(retried)
+        elapsed = time.time() - start
+        self.add_phase_time('arrivals', elapsed)
+        self.count_metric('arrivals', c)
 
-        logger.info("%s, finished processing arrivals, got %d of them",
-                    self_str, c)
+        logger.info("%s, finished processing arrivals, got %d of them "
+                    "in %.3f seconds (%.1f arrivals/s, %d conflicts)",
+                    self_str, c, elapsed, c / elapsed if elapsed else 0.,
+                    conflicts)
         c = 0
+        self.enter_phase('purchases')
+        start = time.time()
+        if self.feed_stream is not None:
+            try:
+                c = self.with_retries(self.purchase_scheduled,
+                                      self_str, 'scheduled purchases') or 0
+            except KeyboardInterrupt:
+                raise
+            except Exception:
+                logger.exception("%s, exception in purchase_scheduled()",
+                                 self_str)
+                self.registry.rollback()
         proceed = True
         while proceed:
             try:
-                proceed = bool(self.purchase())
-                c += 1
+                pack_codes = self.purchase_many()
                 self.registry.commit()
+                self.conflict_resolved()
+                proceed = bool(pack_codes)
+                c += len(pack_codes)
             except KeyboardInterrupt:
                 raise
-            except:
-                logger.exception("%s, exception in purchase()",
-                                 self_str)
-                self.registry.rollback()
+            except Exception as exc:
+                proceed = self.handle_failure(exc, self_str, 'purchases')
 
+        self.add_phase_time('purchases', time.time() - start)
+        self.count_metric('purchases', c)
         logger.info("%s, finished issuing purchases (did %d of them)",
                     self_str, c)
-        Sale = self.registry.Wms.Example.Sale
-        for i in range(self.sales_per_timeslice):
-            Sale.create_random()
-        logger.info("%s, done issuing client sales", self_str)
+        self.enter_phase('sales')
+        start = time.time()
+        Example = self.registry.Wms.Example
+        if self.feed_stream is None:
+            sales = len(Example.Sale.create_random_batch(
+                self.sales_per_timeslice, workload=self.sale_workload()))
+        else:
+            sales = len(Example.Sale.create_many(self.scheduled_sales()))
+        logger.info("%s, done issuing %d client sales", self_str, sales)
         self.registry.commit()
+        self.add_phase_time('sales', time.time() - start)
+        self.count_metric('sales', sales)
+
+    def sale_workload(self):
+        """Return :attr:`workload`, providing it with products if needed.
+
+        If there's no :attr:`workload`, an unseeded one with the legacy
+        distributions gets created.
+        """
+        workload = self.workload
+        if workload is None:
+            workload = self.workload = Workload()
+        if workload.products is None:
+            workload.set_products(
+                self.registry.Wms.PhysObj.Type.all_products())
+        return workload
+
+    def without_given_up(self, query):
+        """Exclude the Operations given up for the current timeslice."""
+        given_up = self.given_up_operations
+        if not given_up:
+            return query
+        return query.filter(
+            self.registry.Wms.Operation.id.notin_(given_up))
+
+    def ready_op_query(self):
+        """Query for the Operations whose inputs are all present.
 
-    def planned_op_lock_query(self):
+        These are exactly the Operations that can be executed right away.
+        Nothing gets locked, see :meth:`ready_op_lock_query` for that.
+        """
+        Wms = self.registry.Wms
+        Operation = Wms.Operation
+        HistoryInput = Operation.HistoryInput
+        Avatar = Wms.PhysObj.Avatar
+        not_ready = exists().where(and_(
+            HistoryInput.operation_id == Operation.id,
+            HistoryInput.avatar_id == Avatar.id,
+            Avatar.state != 'present'))
+        return Operation.query(Operation.id).filter(
+            Operation.type != 'wms_arrival',
+            Operation.state == 'planned',
+            ~not_ready)
+
+    def ready_op_lock_query(self):
+        """Query to lock Operations whose inputs are all present.
+
+        The ``NOT EXISTS`` subquery of :meth:`ready_op_query` doesn't lock
+        anything: only the Operations themselves are locked, hence avoiding
+        the conflicts that a plain join to Avatars would produce.
+        """
         # this caching helps speeding things up between
         # transaction begin and lock querying, hence reducing conflicts
         # (the MVCC snapshot is supposed to be taken at first query,
         #  but I still can see a few)
-        query = getattr(self, '_planned_lock_query', None)
+        query = getattr(self, '_ready_lock_query', None)
         if query is not None:
             return query
         logger.warning("Lock query not found in cache")
-        Operation = self.registry.Wms.Operation
-        query = Operation.query(Operation.id).filter(
-            Operation.type != 'wms_arrival',
-            Operation.state == 'planned').order_by(
-                Operation.dt_execution).with_for_update(
-                    key_share=True,
-                    skip_locked=True)
-        self._planned_lock_query = query
+        query = self.ready_op_query().order_by(
+            self.registry.Wms.Operation.dt_execution).with_for_update(
+                key_share=True,
+                skip_locked=True)
+        self._ready_lock_query = query
         return query
 
-    def select_ready_operation(self):
+    def locked_ready_ops_exist(self):
+        """Tell whether some ready Operations are locked by other workers.
+
+        This is meant to be called right after :meth:`ready_op_lock_query`
+        returned nothing, within the same transaction, hence the same MVCC
+        snapshot: then the ready Operations it sees are being executed by
+        other workers. Once they commit, the Operations depending on them
+        may become ready.
+        """
+        return self.registry.query(
+            self.without_given_up(self.ready_op_query()).exists()).scalar()
+
+    def select_ready_operations(self, limit, fresh_snapshot=True):
+        """Find and lock up to ``limit`` Operations ready to be processed.
+
+        This is done in a single query, see :meth:`ready_op_lock_query`.
+        Operations that aren't ready at this point will become so once
+        their predecessors are executed, by this worker or any other one.
+
+        :param bool fresh_snapshot: if ``True``, commit first to start
+                                    with a fresh MVCC snapshot.
+        :return: list of Operations, ordered by execution date and time
+        """
+        Operation = self.registry.Wms.Operation
+        if fresh_snapshot:
+            # starting with a fresh MVCC snapshot
+            self.registry.commit()
+        ready_ids = [r[0] for r in self.without_given_up(
+            self.ready_op_lock_query()).limit(limit).all()]
+        if not ready_ids:
+            return []
+        return Operation.query().filter(Operation.id.in_(ready_ids)).order_by(
+            Operation.dt_execution).all()
+
+    def select_ready_operation(self, fresh_snapshot=True):
         """Find an operation ready to be processed (and lock it)
 
-        :return: the operation or None and boolean telling if no operation was
-                 found if that's definitive
+        :return: ``(operation, stop)``. If no operation was found, it is
+                 ``None``, and ``stop`` tells if that's definitive, i.e.,
+                 if no ready Operation is locked by other workers (see
+                 :meth:`locked_ready_ops_exist`). Otherwise ``stop`` is
+                 ``False``.
+        :rtype: tuple
+        """
+        ops = self.select_ready_operations(1, fresh_snapshot=fresh_snapshot)
+        if not ops:
+            return None, not self.locked_ready_ops_exist()
+        return ops[0], False
+
+    def process_batch(self):
+        """Find up to :attr:`batch_size` ready Operations and execute them.
+
+        :return: list of executed Operations information, ``True`` if
+                 there's none but others may become ready after other
+                 workers commit (see :meth:`locked_ready_ops_exist`),
+                 ``None`` if there's nothing more to be done.
         """
+        ops = self.select_ready_operations(self.batch_size)
+        if not ops:
+            return True if self.locked_ready_ops_exist() else None
+
+        self.pending_batch = [op.id for op in ops]
+        logger.info("%s, locked %d operations ready to be executed",
+                    self, len(ops))
+        dt_execution = datetime.now()
+        done = []
+        for op in ops:
+            op.execute(dt_execution=dt_execution)
+            done.append((op.__registry_name__, op.id))
+        return done
+
+    def execute_operation(self, op_id):
+        """Lock and execute the given Operation if it is still ready."""
         Operation = self.registry.Wms.Operation
-        # starting with a fresh MVCC snapshot
-        self.registry.commit()
-        # TODO this is too complicated: locking an op then climbing along
-        # the 'follows' relation to find an executable one.
-        # it'd be much simpler to look for an Operation whose inputs are
-        # all present.
-        planned_id = self.planned_op_lock_query().first()
-        if planned_id is None:
-            return None, True
-        planned = Operation.query().get(planned_id)
-        previous_planned = True
-        while previous_planned:
-            previous_planned = [
-                op.id for op in planned.follows if op.state == 'planned']
-            if not previous_planned:
-                break
-            planned = Operation.query().filter(
-                Operation.id.in_(previous_planned)).with_for_update(
-                    key_share=True,
-                    skip_locked=True).first()
-            if planned is None:
-                return None, False
-        return planned, None
+        ready_id = self.ready_op_lock_query().filter(
+            Operation.id == op_id).first()
+        if ready_id is None:
+            return
+        op = Operation.query().get(op_id)
+        op.execute()
+        return op.__registry_name__, op.id
 
     def process_one(self):
         """Find any Operation that can be done, and execute it."""
-        # first alternative: climbing up planned operations, without
-        # complicated outer join to avatars that are conflict sources
-        # for PG
         op, stop = self.select_ready_operation()
         if op is None:
             if stop:
@@ -229,6 +569,7 @@ class Regular(Mixin.WmsBasicSellerUtil):
 
         logger.info("%s, found op ready to be executed: %r, doing it now.",
                     self, op)
+        self.pending_batch = [op.id]
         op.execute()
         # returning op info instead of instance to avoid any
         # after-commit query
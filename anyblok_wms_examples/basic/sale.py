@@ -6,11 +6,11 @@
 # This Source Code Form is subject to the terms of the Mozilla Public License,
 # v. 2.0. If a copy of the MPL was not distributed with this file,You can
 # obtain one at http://mozilla.org/MPL/2.0/.
-from random import randrange
-
 from anyblok import Declarations
 from anyblok.column import Integer
 from anyblok_postgres.column import Jsonb
+
+from ..workload import Workload
 register = Declarations.register
 Example = Declarations.Model.Wms.Example
 
@@ -32,17 +32,79 @@ class Sale:
 
         req = Reservation.Request.insert(purpose=['sale', sale.id])
         for product, qty in contents.items():
-            gt = GoodsType.query().filter(GoodsType.code == product).one()
-            RequestItem.insert(goods_type=gt,
+            RequestItem.insert(goods_type_id=GoodsType.id_by_code(product),
                                quantity=qty,
                                request=req)
         return sale, req
 
     @classmethod
-    def create_random(cls):
-        contents = {}
-        for _ in range(randrange(4)):
-            width = randrange(25, 45)
-            height = randrange(20, 40)
-            contents['JEANS/%d/%d' % (width, height)] = randrange(1, 3)
-        return cls.create(contents)
+    def create_many(cls, all_contents):
+        """Create many Sales and their Reservation Requests at once.
+
+        Contrary to :meth:`create`, this issues a fixed number of
+        statements: one multi-row ``INSERT`` for each of the Sale,
+        Request and RequestItem tables.
+
+        :param all_contents: iterable of Sale contents, as in :meth:`create`
+        :return: list of ``(sale id, Request id)`` pairs
+        """
+        all_contents = list(all_contents)
+        if not all_contents:
+            return []
+        Wms = cls.registry.Wms
+        Reservation = Wms.Reservation
+        GoodsType = Wms.PhysObj.Type
+        execute = cls.registry.execute
+
+        # RETURNING gives us the contents back, so that we don't have to
+        # rely on the ordering of returned rows
+        sale_table = cls.__table__
+        sales = dict(execute(
+            sale_table.insert().values(
+                [dict(contents=contents) for contents in all_contents]
+            ).returning(sale_table.c.id, sale_table.c.contents)).fetchall())
+
+        req_table = Reservation.Request.__table__
+        reqs = execute(
+            req_table.insert().values(
+                [dict(purpose=['sale', sale_id], reserved=False, planned=False)
+                 for sale_id in sales]
+            ).returning(req_table.c.id, req_table.c.purpose)).fetchall()
+
+        items = [dict(request_id=req_id,
+                      goods_type_id=GoodsType.id_by_code(product),
+                      quantity=qty)
+                 for req_id, purpose in reqs
+                 for product, qty in sales[purpose[1]].items()]
+        if items:
+            execute(Reservation.RequestItem.__table__.insert().values(items))
+        return [(purpose[1], req_id) for req_id, purpose in reqs]
+
+    @classmethod
+    def default_workload(cls):
+        """An unseeded workload, with the legacy distributions."""
+        return Workload(
+            products=cls.registry.Wms.PhysObj.Type.all_products())
+
+    @classmethod
+    def random_contents(cls, workload=None):
+        """Draw the contents of a sale.
+
+        :param workload: a :class:`anyblok_wms_examples.workload.Workload`
+                         instance. Defaults to :meth:`default_workload`.
+        """
+        if workload is None:
+            workload = cls.default_workload()
+        return workload.sale_contents()
+
+    @classmethod
+    def create_random(cls, workload=None):
+        return cls.create(cls.random_contents(workload=workload))
+
+    @classmethod
+    def create_random_batch(cls, count, workload=None):
+        """Create ``count`` random Sales, using :meth:`create_many`."""
+        if workload is None:
+            workload = cls.default_workload()
+        return cls.create_many(workload.sale_contents()
+                               for _ in range(count))
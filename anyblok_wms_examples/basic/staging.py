@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Examples project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import logging
+
+from anyblok import Declarations
+from anyblok.column import Integer
+from anyblok.column import String
+from anyblok_postgres.column import Jsonb
+
+from ..workload import FEED_COLUMNS
+from ..workload import open_feed
+
+logger = logging.getLogger(__name__)
+
+register = Declarations.register
+Example = Declarations.Model.Wms.Example
+
+
+@register(Example)
+class WorkloadStaging:
+    """Pre-generated workload, waiting to be processed by regular workers.
+
+    Lines are loaded from feed files with :meth:`load_feed`, and consumed
+    by :meth:`pull`. Each regular worker only pulls the lines of its own
+    stream, hence they don't contend on this table.
+    """
+    id = Integer(label="Identifier", primary_key=True)
+    timeslice = Integer(label="Relative timeslice", nullable=False)
+    stream = Integer(label="Regular worker number", nullable=False,
+                     index=True)
+    kind = String(label="Sale or purchase", nullable=False)
+    contents = Jsonb(label="Quantities by product")
+
+    @classmethod
+    def load_feed(cls, path):
+        """Load a feed file with ``COPY``.
+
+        See :data:`anyblok_wms_examples.workload.FEED_COLUMNS` for
+        the format.
+
+        :return: number of loaded lines
+        """
+        cursor = cls.registry.session.connection().connection.cursor()
+        with open_feed(path) as feed_file:
+            cursor.copy_expert(
+                "COPY %s (%s) FROM STDIN WITH (FORMAT csv, HEADER true)" % (
+                    cls.__table__.name, ', '.join(FEED_COLUMNS)),
+                feed_file)
+        logger.info("Loaded %d workload lines from %r", cursor.rowcount, path)
+        return cursor.rowcount
+
+    @classmethod
+    def pull(cls, stream, timeslice, kind):
+        """Delete and return the due lines of the given stream and kind.
+
+        Lines of previous timeslices that haven't been pulled yet are
+        returned as well. Since they are deleted in the current transaction,
+        they are pulled again if it gets rolled back.
+
+        :param int timeslice: relative timeslice, i.e., starting from 1 for
+                              the first timeslice of the run.
+        :return: list of contents, in loading order
+        """
+        table = cls.__table__
+        rows = cls.registry.execute(table.delete().where(
+            (table.c.stream == stream) &
+            (table.c.timeslice <= timeslice) &
+            (table.c.kind == kind)).returning(
+                table.c.id, table.c.contents)).fetchall()
+        return [contents for _, contents in sorted(rows)]
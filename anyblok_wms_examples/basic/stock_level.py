@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Examples project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import csv
+import io
+import logging
+
+from anyblok import Declarations
+from anyblok.column import Integer
+from anyblok.column import String
+
+logger = logging.getLogger(__name__)
+
+register = Declarations.register
+Example = Declarations.Model.Wms.Example
+
+
+@register(Example)
+class StockLevel:
+    """Incrementally maintained count of present and future PhysObj.
+
+    There's one line per product. The :attr:`quantity` is the number of
+    current (``dt_until IS NULL``) Avatars in the ``present`` or ``future``
+    states, whose PhysObj Type is for that product, packs included.
+
+    It is maintained by PostgreSQL triggers on Avatars and PhysObj Types
+    (see :meth:`install_triggers`), so that finding missing products
+    doesn't need to scan all Avatars.
+
+    Note that the lines of products being planned or executed concurrently
+    are hot spots. To keep them as cool as possible, the triggers don't
+    update anything if the net change is zero (as is the case for the
+    execution of Moves and Unpacks).
+    """
+    product = String(label="Product", primary_key=True)
+    quantity = Integer(label="Present and future count",
+                       nullable=False, default=0, index=True)
+
+    @classmethod
+    def install_triggers(cls):
+        """Create (or replace) the triggers maintaining the table.
+
+        Increases of quantities also wake up the Reservers, since
+        pending Requests may have become reservable. This relies on the
+        ``wms_example_notify()`` function created by
+        ``Wms.Worker.install_triggers()``.
+        """
+        cls.registry.execute("""
+        CREATE OR REPLACE FUNCTION wms_example_stocklevel_add(integer, integer)
+        RETURNS void AS $$
+          UPDATE wms_example_stocklevel sl SET quantity = sl.quantity + $2
+          FROM wms_physobj po
+          JOIN wms_physobj_type pot ON pot.id = po.type_id
+          WHERE po.id = $1 AND sl.product = pot.product;
+        $$ LANGUAGE sql;
+
+        CREATE OR REPLACE FUNCTION wms_example_stocklevel_avatar()
+        RETURNS trigger AS $$
+        DECLARE
+          old_in integer := 0;
+          new_in integer := 0;
+        BEGIN
+          IF TG_OP <> 'INSERT' THEN
+            IF OLD.state IN ('present', 'future')
+               AND OLD.dt_until IS NULL THEN
+              old_in := 1;
+            END IF;
+          END IF;
+          IF TG_OP <> 'DELETE' THEN
+            IF NEW.state IN ('present', 'future')
+               AND NEW.dt_until IS NULL THEN
+              new_in := 1;
+            END IF;
+          END IF;
+          IF TG_OP = 'UPDATE' THEN
+            IF OLD.obj_id = NEW.obj_id THEN
+              IF new_in <> old_in THEN
+                PERFORM wms_example_stocklevel_add(NEW.obj_id,
+                                                   new_in - old_in);
+              END IF;
+              RETURN NULL;
+            END IF;
+          END IF;
+          IF old_in = 1 THEN
+            PERFORM wms_example_stocklevel_add(OLD.obj_id, -1);
+          END IF;
+          IF new_in = 1 THEN
+            PERFORM wms_example_stocklevel_add(NEW.obj_id, 1);
+          END IF;
+          RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE OR REPLACE FUNCTION wms_example_stocklevel_type()
+        RETURNS trigger AS $$
+        BEGIN
+          IF NEW.product IS NOT NULL THEN
+            INSERT INTO wms_example_stocklevel (product, quantity)
+            VALUES (NEW.product, 0)
+            ON CONFLICT (product) DO NOTHING;
+          END IF;
+          RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS wms_example_stocklevel_avatar
+          ON wms_physobj_avatar;
+        CREATE TRIGGER wms_example_stocklevel_avatar
+          AFTER INSERT OR UPDATE OF state, dt_until, obj_id OR DELETE
+          ON wms_physobj_avatar
+          FOR EACH ROW EXECUTE PROCEDURE wms_example_stocklevel_avatar();
+
+        DROP TRIGGER IF EXISTS wms_example_stocklevel_type
+          ON wms_physobj_type;
+        CREATE TRIGGER wms_example_stocklevel_type
+          AFTER INSERT OR UPDATE OF product
+          ON wms_physobj_type
+          FOR EACH ROW EXECUTE PROCEDURE wms_example_stocklevel_type();
+
+        DROP TRIGGER IF EXISTS wms_example_stocklevel_notify
+          ON wms_example_stocklevel;
+        CREATE TRIGGER wms_example_stocklevel_notify
+          AFTER UPDATE OF quantity ON wms_example_stocklevel
+          FOR EACH ROW WHEN (NEW.quantity > OLD.quantity)
+          EXECUTE PROCEDURE wms_example_notify('%s');
+        """ % cls.registry.Wms.Worker.RESERVER_CHANNEL)
+
+    @classmethod
+    def triggers_installed(cls):
+        """Tell whether the triggers maintaining the table are there."""
+        return cls.registry.execute(
+            "SELECT count(*) FROM pg_trigger "
+            "WHERE tgname = 'wms_example_stocklevel_avatar'").scalar() > 0
+
+    @classmethod
+    def seed(cls, level, location_code='stock', chunk_size=1000,
+             products=None):
+        """Bring the count of all products up to ``level`` at once.
+
+        The missing goods are created as present PhysObj in the given
+        location, with ``COPY`` rather than through Operations. All their
+        Avatars have a single Apparition of zero quantity as reason.
+
+        The row-level trigger on Avatars is disabled during the ``COPY``,
+        and the lines of this table are updated afterwards by a single
+        statement. Note that this locks the Avatars table until the end
+        of the transaction.
+
+        :param int chunk_size: number of products per ``COPY`` statement
+        :param products: if specified, only these products are seeded
+        :return: number of created PhysObj
+        """
+        Wms = cls.registry.Wms
+        PhysObj = Wms.PhysObj
+        Type = PhysObj.Type
+        query = cls.query('product', 'quantity').filter(cls.quantity < level)
+        if products is not None:
+            query = query.filter(cls.product.in_(products))
+        missing = [(product, Type.id_by_code(product), level - quantity)
+                   for product, quantity in query.order_by(cls.product).all()]
+        if not missing:
+            return 0
+
+        location = PhysObj.query().filter_by(code=location_code).one()
+        reason = Wms.Operation.Apparition.create(
+            state='done', location=location, quantity=0)
+        cls.registry.flush()
+        maintained = cls.triggers_installed()
+        if maintained:
+            cls.registry.execute(
+                "ALTER TABLE wms_physobj_avatar "
+                "DISABLE TRIGGER wms_example_stocklevel_avatar")
+        cursor = cls.registry.session.connection().connection.cursor()
+        total = 0
+        for start in range(0, len(missing), chunk_size):
+            chunk = missing[start:start + chunk_size]
+            count = sum(qty for _, _, qty in chunk)
+            obj_ids = iter(r[0] for r in cls.registry.execute(
+                "SELECT nextval(pg_get_serial_sequence('wms_physobj', 'id')) "
+                "FROM generate_series(1, :count)",
+                dict(count=count)).fetchall())
+            objs, avatars = io.StringIO(), io.StringIO()
+            objs_writer, avatars_writer = csv.writer(objs), csv.writer(avatars)
+            for _, type_id, qty in chunk:
+                for _ in range(qty):
+                    obj_id = next(obj_ids)
+                    objs_writer.writerow((obj_id, type_id))
+                    avatars_writer.writerow(
+                        (obj_id, location.id, 'present',
+                         reason.dt_execution.isoformat(), reason.id))
+            objs.seek(0)
+            avatars.seek(0)
+            cursor.copy_expert("COPY wms_physobj (id, type_id) "
+                               "FROM STDIN WITH (FORMAT csv)", objs)
+            cursor.copy_expert("COPY wms_physobj_avatar "
+                               "(obj_id, location_id, state, dt_from, "
+                               "reason_id) FROM STDIN WITH (FORMAT csv)",
+                               avatars)
+            total += count
+        if maintained:
+            cls.registry.execute(
+                "ALTER TABLE wms_physobj_avatar "
+                "ENABLE TRIGGER wms_example_stocklevel_avatar")
+            cls.registry.execute(
+                "UPDATE wms_example_stocklevel sl "
+                "SET quantity = sl.quantity + seeded.quantity "
+                "FROM unnest(:products, :quantities) "
+                "AS seeded (product, quantity) "
+                "WHERE sl.product = seeded.product",
+                dict(products=[product for product, _, _ in missing],
+                     quantities=[qty for _, _, qty in missing]))
+        logger.info("Seeded %d PhysObj in %r for %d products",
+                    total, location_code, len(missing))
+        return total
+
+    @classmethod
+    def full_count_query(cls):
+        """The reference query, computing the counts from scratch.
+
+        This is a full aggregation over Types, PhysObj and Avatars.
+        """
+        return """
+        SELECT pot.product, count(av.id)
+        FROM wms_physobj_type pot
+        LEFT JOIN wms_physobj po ON po.type_id = pot.id
+        LEFT JOIN wms_physobj_avatar av
+               ON av.obj_id = po.id
+              AND av.state IN ('present', 'future')
+              AND av.dt_until IS NULL
+        WHERE pot.product IS NOT NULL
+        GROUP BY pot.product
+        """.strip()
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute all lines from scratch.
+
+        This is meant for databases where the triggers were installed after
+        some Avatars got created.
+        """
+        execute = cls.registry.execute
+        execute("DELETE FROM wms_example_stocklevel")
+        execute("INSERT INTO wms_example_stocklevel (product, quantity) "
+                + cls.full_count_query())
+
+    @classmethod
+    def check_consistency(cls):
+        """Compare the table with :meth:`full_count_query`
+
+        The missing products are also compared with those given by
+        the ``missing_product_full_query()`` of regular workers, and
+        differences are logged.
+
+        :return: sorted list of ``(product, expected, actual)`` for all
+                 discrepancies. ``actual`` is ``None`` if the line is
+                 missing altogether, ``expected`` is ``None`` if the
+                 product is unknown.
+        """
+        execute = cls.registry.execute
+        expected = dict(execute(cls.full_count_query()).fetchall())
+        actual = dict(execute("SELECT product, quantity "
+                              "FROM wms_example_stocklevel").fetchall())
+        errors = [(product, count, actual.get(product))
+                  for product, count in expected.items()
+                  if actual.get(product) != count]
+        errors.extend((product, None, count)
+                      for product, count in actual.items()
+                      if product not in expected)
+
+        Regular = cls.registry.Wms.Worker.Regular
+        missing = set(r[0] for r in execute(
+            Regular.missing_product_full_query()).fetchall())
+        missing_fast = set(r[0] for r in execute(
+            Regular.missing_product_query()).fetchall())
+        if missing != missing_fast:
+            logger.error("Missing products differ: %d according to the full "
+                         "query, %d according to %s (symmetric difference "
+                         "%r)", len(missing), len(missing_fast),
+                         cls.__registry_name__, missing ^ missing_fast)
+        if errors:
+            logger.error("%s is inconsistent for %d products",
+                         cls.__registry_name__, len(errors))
+        return sorted(errors)
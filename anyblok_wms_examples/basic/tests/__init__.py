@@ -6,3 +6,30 @@
 # This Source Code Form is subject to the terms of the Mozilla Public License,
 # v. 2.0. If a copy of the MPL was not distributed with this file,You can
 # obtain one at http://mozilla.org/MPL/2.0/.
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+
+@contextmanager
+def savepoint_commits(registry):
+    """Turn commits of the registry into releases of savepoints.
+
+    Once a test has been torn down, nothing protects the database from
+    actual commits issued by the code under test, such as the workers.
+
+    Rollbacks are confined the same way, hence they only cancel changes
+    made since the previous commit.
+    """
+    session = registry.session
+    current = [session.begin_nested()]
+
+    def restart_savepoint(session, transaction):
+        if transaction is current[0]:
+            current[0] = session.begin_nested()
+
+    event.listen(session, 'after_transaction_end', restart_savepoint)
+    try:
+        yield
+    finally:
+        event.remove(session, 'after_transaction_end', restart_savepoint)
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Examples project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+from unittest import TestCase
+
+from anyblok_wms_examples.basic.benchmarks.base import timing_stats
+from anyblok_wms_examples.basic.benchmarks.compare import compare
+
+
+class BenchmarkResultsTestCase(TestCase):
+
+    def test_timing_stats(self):
+        stats = timing_stats([0.1, 0.3, 0.2])
+        self.assertEqual(stats['rounds'], 3)
+        self.assertEqual(stats['min'], 0.1)
+        self.assertEqual(stats['max'], 0.3)
+        self.assertAlmostEqual(stats['median'], 0.2)
+        self.assertAlmostEqual(stats['ops'], 5.)
+        self.assertEqual(timing_stats([0.5])['stddev'], 0.)
+
+    def test_compare(self):
+        before = dict(results={'0': {'Sale.create': dict(median=0.2)},
+                               '10000': {'Sale.create': dict(median=0.4),
+                                         'Gone': dict(median=1.)}})
+        after = dict(results={'0': {'Sale.create': dict(median=0.1)},
+                              '10000': {'Sale.create': dict(median=0.6)}})
+        self.assertEqual(compare(before, after),
+                         [(0, 'Sale.create', 0.2, 0.1, 0.5),
+                          (10000, 'Sale.create', 0.4, 0.6,
+                           0.6 / 0.4)])
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Examples project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+from anyblok_wms_base.testing import WmsTestCase
+
+from . import savepoint_commits
+
+
+class TypeIndexTestCase(WmsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.Type = self.registry.Wms.PhysObj.Type
+        self.Type.invalidate_code_index()
+
+    def tearDown(self):
+        self.Type.invalidate_code_index()
+        super().tearDown()
+
+    def test_id_by_code(self):
+        Type = self.Type
+        jeans = Type.query().filter_by(code='JEANS/31/32').one()
+        pack = Type.query().filter_by(code='JEANS/31/32/PCK').one()
+        self.assertEqual(Type.id_by_code('JEANS/31/32'), jeans.id)
+        self.assertEqual(Type.id_by_code('JEANS/31/32/PCK'), pack.id)
+        self.assertEqual(Type.pack_id_by_product('JEANS/31/32'), pack.id)
+        with self.assertRaises(KeyError):
+            Type.id_by_code('UNKNOWN')
+
+    def test_invalidation_on_insert(self):
+        Type = self.Type
+        Type.id_by_code('JEANS/31/32')
+        self.assertIn(self.registry.db_name, Type._code_index)
+
+        shorts = Type.insert(code='SHORTS/31', product='SHORTS/31')
+        self.assertNotIn(self.registry.db_name, Type._code_index)
+        self.assertEqual(Type.id_by_code('SHORTS/31'), shorts.id)
+
+    def test_invalidation_on_rollback(self):
+        Type = self.Type
+        with savepoint_commits(self.registry):
+            Type.insert(code='SHORTS/31', product='SHORTS/31')
+            self.registry.commit()
+            Type.id_by_code('SHORTS/31')
+            self.assertIn(self.registry.db_name, Type._code_index)
+            self.registry.rollback()
+            self.assertNotIn(self.registry.db_name, Type._code_index)
+
+    def test_fallback_on_miss(self):
+        Type = self.Type
+        Type.id_by_code('JEANS/31/32')
+        # as if inserted by another process
+        self.registry.execute(
+            "INSERT INTO wms_physobj_type (code, product, behaviours) "
+            "VALUES ('SHORTS/31', 'SHORTS/31', NULL), "
+            "('SHORTS/31/PCK', 'SHORTS/31', '{\"unpack\": {}}')")
+        shorts, pack = [
+            Type.query().filter_by(code=code).one().id
+            for code in ('SHORTS/31', 'SHORTS/31/PCK')]
+        self.assertEqual(Type.id_by_code('SHORTS/31'), shorts)
+        self.assertEqual(Type.pack_id_by_product('SHORTS/31'), pack)
+        # now in the indexes
+        self.assertEqual(
+            Type._code_index[self.registry.db_name]['SHORTS/31'], shorts)
+        with self.assertRaises(KeyError):
+            Type.pack_id_by_product('UNKNOWN')
+
+    def test_all_products(self):
+        products = self.Type.all_products()
+        self.assertEqual(len(products), 400)
+        self.assertIn('JEANS/31/32', products)
+        self.assertEqual(products, sorted(products))
+
+    def test_pack_id_several_packs(self):
+        Type = self.Type
+        pack = Type.query().filter_by(code='JEANS/31/32/PCK').one()
+        Type.insert(code='JEANS/31/32/PCK50', product='JEANS/31/32',
+                    behaviours=dict(unpack=dict(
+                        uniform_outcomes=True,
+                        outcomes=[dict(type='JEANS/31/32', quantity=50)])))
+        self.assertEqual(Type.pack_id_by_product('JEANS/31/32'), pack.id)
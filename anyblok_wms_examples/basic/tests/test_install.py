@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Examples project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+from anyblok_wms_base.testing import WmsTestCase
+
+from anyblok_wms_examples.basic import Seller
+from anyblok_wms_examples.basic import pack_code
+from anyblok_wms_examples.basic import product_code
+
+
+class SellerInstallTestCase(WmsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        Wms = self.Wms = self.registry.Wms
+        self.PhysObj = Wms.PhysObj
+        self.blok = Seller(self.registry)
+
+    def test_default_catalogue(self):
+        self.assertEqual(set(self.Wms.PhysObj.Type.all_products()),
+                         set(product_code(i) for i in range(400)))
+        self.assertEqual(product_code(0), 'JEANS/25/20')
+        self.assertEqual(product_code(399), 'JEANS/44/39')
+
+    def test_pack_behaviours(self):
+        Type = self.Wms.PhysObj.Type
+        pack = Type.query().filter_by(code='JEANS/31/32/PCK').one()
+        self.assertEqual(pack.product, 'JEANS/31/32')
+        self.assertEqual(pack.behaviours, dict(unpack=dict(
+            uniform_outcomes=True,
+            outcomes=[dict(type='JEANS/31/32', quantity=20)])))
+        self.assertEqual(Type.pack_id_by_product('JEANS/31/32'), pack.id)
+        jeans = Type.query().filter_by(code='JEANS/31/32').one()
+        self.assertIsNone(jeans.behaviours)
+
+    def test_pack_code(self):
+        self.assertEqual(pack_code('JEANS/25/20', 0, 20), 'JEANS/25/20/PCK')
+        self.assertEqual(pack_code('JEANS/25/20', 1, 5), 'JEANS/25/20/PCK5')
+
+    def test_location_tree(self):
+        PhysObj = self.PhysObj
+        Avatar = PhysObj.Avatar
+        root = PhysObj.query().filter_by(code='warehouse').one()
+        self.blok.install_location_tree(root, root.type, 2, 3, 4)
+
+        bin_ = PhysObj.query().filter_by(code='Z2-A3-B4').one()
+        aisle = PhysObj.query().filter_by(code='Z2-A3').one()
+        zone = PhysObj.query().filter_by(code='Z2').one()
+        for obj, location in ((bin_, aisle), (aisle, zone), (zone, root)):
+            avatar = Avatar.query().filter_by(obj=obj).one()
+            self.assertEqual(avatar.location, location)
+            self.assertEqual(avatar.state, 'present')
+
+        self.assertEqual(
+            PhysObj.query().filter(PhysObj.code.like('Z%')).count(),
+            2 + 2 * 3 + 2 * 3 * 4)
+        # all Avatars share the same reason
+        self.assertEqual(Avatar.query('reason_id').join(
+            Avatar.obj).filter(PhysObj.code.like('Z%')).distinct().count(),
+            1)
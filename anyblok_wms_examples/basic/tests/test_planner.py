@@ -8,6 +8,8 @@
 # obtain one at http://mozilla.org/MPL/2.0/.
 from anyblok_wms_base.testing import WmsTestCase
 
+from . import savepoint_commits
+
 
 class PlannerTestCase(WmsTestCase):
 
@@ -28,6 +30,21 @@ class PlannerTestCase(WmsTestCase):
         planner.maybe_sleep(prefix, True)
         self.assertEqual(planner.inactivity_count, 0)
 
+    def test_should_proceed_cache(self):
+        Planner = self.Planner
+        regular = self.Regular.insert(active=True)
+        try:
+            with savepoint_commits(self.registry):
+                self.assertTrue(Planner.should_proceed(refresh=True))
+                regular.active = False
+                self.registry.flush()
+                # still using the cached count
+                self.assertTrue(Planner.should_proceed())
+                self.assertFalse(Planner.should_proceed(refresh=True))
+                self.assertFalse(Planner.should_proceed())
+        finally:
+            Planner._active_count = None
+
     def test_pick_request(self):
         regular = self.Regular.insert()
         planner = self.Planner.insert()
@@ -139,3 +156,46 @@ class PlannerTestCase(WmsTestCase):
     def test_nothing_to_do(self):
         planner = self.Planner.insert()
         self.assertFalse(planner.process_one())
+
+    def test_batch(self):
+        regular = self.Regular.insert()
+        planner = self.Planner.insert(batch_size=10)
+        Operation = self.Wms.Operation
+        pack_codes = set((regular.purchase(), regular.purchase()))
+        self.assertEqual(len(pack_codes), 2)
+
+        sale, sale_req = self.Wms.Example.Sale.create({})
+        sale_req.reserve()
+
+        with planner.claim_requests(10) as req_ids:
+            unfolded = planner.unfold_requests(req_ids)
+        self.assertEqual(len(unfolded), 3)
+        self.assertEqual([len(resas) for _, resas, _ in unfolded], [1, 1, 0])
+        for req, resas, avatars in unfolded[:2]:
+            self.assertEqual(req.purpose, 'unpack')
+            self.assertEqual(avatars[0].obj, resas[0].physobj)
+            self.assertEqual(avatars[0].state, 'future')
+
+        self.assertTrue(planner.process_one())
+        self.assertEqual(self.Request.query().filter_by(planned=False).count(),
+                         0)
+        self.assertEqual(
+            set(op.input.obj.type.code
+                for op in Operation.Move.query().all()),
+            pack_codes)
+        self.assertEqual(Operation.Unpack.query().count(), 2)
+        # nothing left
+        self.assertFalse(planner.process_one())
+
+    def test_current_avatars(self):
+        regular = self.Regular.insert()
+        planner = self.Planner.insert()
+        regular.purchase()
+        regular.purchase()
+
+        resas = self.Wms.Reservation.query().order_by(
+            self.Wms.Reservation.physobj_id.desc()).all()
+        avatars = planner.current_avatars(resas)
+        self.assertEqual([av.obj for av in avatars],
+                         [resa.physobj for resa in resas])
+        self.assertEqual(planner.current_avatars([]), [])
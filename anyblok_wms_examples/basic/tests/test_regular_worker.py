@@ -6,8 +6,14 @@
 # This Source Code Form is subject to the terms of the Mozilla Public License,
 # v. 2.0. If a copy of the MPL was not distributed with this file,You can
 # obtain one at http://mozilla.org/MPL/2.0/.
+from types import SimpleNamespace
+
+from psycopg2.extensions import TransactionRollbackError
+from sqlalchemy.exc import OperationalError
 from anyblok_wms_base.testing import WmsTestCase
 
+from . import savepoint_commits
+
 
 class RegularWorkerTestCase(WmsTestCase):
 
@@ -95,14 +101,284 @@ class RegularWorkerTestCase(WmsTestCase):
         for arrival in Operation.Arrival.query().all():
             arrival.execute()
 
-        orig_commit = regular.registry.commit
-        regular.registry.commit = lambda: None
-        try:
-            self.assertEqual(regular.process_one()[0], 'Model.Wms.Operation.Move')
+        with savepoint_commits(self.registry):
+            self.assertEqual(regular.process_one()[0],
+                             'Model.Wms.Operation.Move')
             unpack_info = regular.process_one()
-        finally:
-            regular.registry.commit = orig_commit
         self.assertEqual(unpack_info[0], 'Model.Wms.Operation.Unpack')
         unpack_op = Operation.query().get(unpack_info[1])
         for av in unpack_op.outcomes:
             self.assertEqual(av.state, 'present')
+
+    def test_process_batch(self):
+        regular = self.Worker(batch_size=10)
+        planner = self.Wms.Worker.Planner.insert()
+
+        regular.purchase()
+        planner.process_one()
+
+        Operation = self.Wms.Operation
+        for arrival in Operation.Arrival.query().all():
+            arrival.execute()
+
+        with savepoint_commits(self.registry):
+            # the Unpack is not ready until the Move is done
+            moves = regular.process_batch()
+            self.assertEqual([m[0] for m in moves],
+                             ['Model.Wms.Operation.Move'])
+            self.assertEqual(regular.pending_batch, [moves[0][1]])
+            unpacks = regular.process_batch()
+            self.assertEqual([u[0] for u in unpacks],
+                             ['Model.Wms.Operation.Unpack'])
+            self.assertIsNone(regular.process_batch())
+
+    def test_execute_operation(self):
+        regular = self.Worker()
+        planner = self.Wms.Worker.Planner.insert()
+
+        regular.purchase()
+        planner.process_one()
+
+        Operation = self.Wms.Operation
+        move = Operation.Move.query().one()
+        unpack = Operation.Unpack.query().one()
+        # the Arrival isn't executed yet
+        self.assertIsNone(regular.execute_operation(move.id))
+
+        for arrival in Operation.Arrival.query().all():
+            arrival.execute()
+        self.assertIsNone(regular.execute_operation(unpack.id))
+        self.assertEqual(regular.execute_operation(move.id),
+                         ('Model.Wms.Operation.Move', move.id))
+        self.assertEqual(move.state, 'done')
+        # already done
+        self.assertIsNone(regular.execute_operation(move.id))
+
+    def test_select_ready_operations(self):
+        regular = self.Worker()
+        planner = self.Wms.Worker.Planner.insert()
+
+        regular.purchase()
+        planner.process_one()
+
+        Operation = self.Wms.Operation
+        # nothing is ready before the Arrival is executed
+        self.assertEqual(
+            regular.select_ready_operations(10, fresh_snapshot=False), [])
+        for arrival in Operation.Arrival.query().all():
+            arrival.execute()
+
+        move = Operation.Move.query().one()
+        self.assertEqual(
+            regular.select_ready_operations(10, fresh_snapshot=False), [move])
+        # given up Operations are ignored
+        regular.given_up_operations = frozenset((move.id, ))
+        self.assertEqual(
+            regular.select_ready_operations(10, fresh_snapshot=False), [])
+        self.assertFalse(regular.locked_ready_ops_exist())
+        regular.given_up_operations = frozenset()
+        move.execute()
+        unpack = Operation.Unpack.query().one()
+        self.assertEqual(
+            regular.select_ready_operations(10, fresh_snapshot=False),
+            [unpack])
+
+    def test_select_ready_operation_locked(self):
+        regular = self.Worker()
+        planner = self.Wms.Worker.Planner.insert()
+
+        regular.purchase()
+        planner.process_one()
+        # nothing is ready, nor will be during this timeslice
+        self.assertEqual(regular.select_ready_operation(fresh_snapshot=False),
+                         (None, True))
+
+        for arrival in self.Wms.Operation.Arrival.query().all():
+            arrival.execute()
+        # the Move is ready, but as if it were locked by another worker
+        regular.select_ready_operations = lambda *a, **kw: []
+        self.assertEqual(regular.select_ready_operation(fresh_snapshot=False),
+                         (None, False))
+        regular.batch_size = 10
+        with savepoint_commits(self.registry):
+            self.assertIs(regular.process_one(), True)
+            self.assertIs(regular.process_batch(), True)
+
+    def test_purchase_many(self):
+        worker = self.Worker.insert(done_timeslice=1, active=True)
+        worker.missing_product_query = lambda: (
+            "SELECT product FROM wms_physobj_type "
+            "WHERE product IN ('JEANS/31/31', 'JEANS/31/32') "
+            "AND code = product")
+        pack_codes = worker.purchase_many()
+        self.assertEqual(sorted(pack_codes),
+                         ['JEANS/31/31/PCK', 'JEANS/31/32/PCK'])
+
+        Arrival = self.Wms.Operation.Arrival
+        self.assertEqual(
+            sorted((arr.goods_type.code, arr.timeslice)
+                   for arr in Arrival.query().all()),
+            [('JEANS/31/31/PCK', 4), ('JEANS/31/32/PCK', 4)])
+        resas = self.Wms.Reservation.query().all()
+        self.assertEqual(sorted(resa.physobj.type.code for resa in resas),
+                         sorted(pack_codes))
+        for resa in resas:
+            self.assertEqual(resa.quantity, 1)
+            item = resa.request_item
+            self.assertEqual(item.goods_type, resa.physobj.type)
+            self.assertEqual(item.request.purpose, "unpack")
+            self.assertTrue(item.request.reserved)
+
+    def test_purchase_scheduled_unknown_product(self):
+        worker = self.Worker.insert(done_timeslice=1, active=True)
+        worker.feed_stream = 0
+        self.Wms.Example.WorkloadStaging.insert(
+            timeslice=2, stream=0, kind='purchase',
+            contents={'JEANS/25/28': 2, 'UNKNOWN': 3})
+        self.assertEqual(worker.purchase_scheduled(), 2)
+        Arrival = self.Wms.Operation.Arrival
+        self.assertEqual([arr.goods_type.code for arr in Arrival.query()],
+                         ['JEANS/25/28/PCK'] * 2)
+        self.assertEqual(self.Wms.Example.WorkloadStaging.query().count(), 0)
+
+    def test_scheduled_sales_unknown_product(self):
+        worker = self.Worker.insert(done_timeslice=1, active=True)
+        worker.feed_stream = 0
+        Staging = self.Wms.Example.WorkloadStaging
+        Staging.insert(timeslice=2, stream=0, kind='sale',
+                       contents={'JEANS/25/28': 1, 'UNKNOWN': 3})
+        Staging.insert(timeslice=2, stream=0, kind='sale',
+                       contents={'JEANS/25/28': 2})
+        self.assertEqual(worker.scheduled_sales(), [{'JEANS/25/28': 2}])
+        self.assertEqual(Staging.query().count(), 0)
+
+    def test_purchase_batch_size(self):
+        worker = self.Worker.insert(active=True)
+        self.Worker.insert(active=True)
+        self.Worker.insert(active=False)
+        self.assertEqual(worker.purchase_batch_size(5), 3)
+        self.assertEqual(worker.purchase_batch_size(4), 2)
+
+    def test_process_arrivals(self):
+        worker = self.Worker.insert(done_timeslice=0)
+        pack_code = worker.purchase()
+        # scheduled in the future
+        self.assertEqual(worker.process_arrivals(10), 0)
+
+        worker.done_timeslice += 2
+        self.assertEqual(worker.process_arrivals(10), 1)
+        arrival = self.single_result(self.Arrival.query())
+        self.assertEqual(arrival.state, 'done')
+        self.assertEqual(arrival.goods_type.code, pack_code)
+
+        # no more to be done
+        self.assertEqual(worker.process_arrivals(10), 0)
+
+    def test_wait_others_last_one(self):
+        worker = self.Worker.insert(active=True, done_timeslice=2)
+        self.Worker.insert(active=False, done_timeslice=1)
+        with savepoint_commits(self.registry):
+            # we are the last one to finish: no waiting at all
+            self.assertLess(worker.wait_others(2), 1)
+            self.assertTrue(worker.listening)
+
+    def test_all_finished_previous_runs(self):
+        # timeslices are counted across runs on the same database
+        worker = self.Worker.insert(active=True, done_timeslice=11)
+        self.Worker.insert(active=True, done_timeslice=10)
+        self.assertFalse(worker.all_finished(11))
+        self.assertTrue(worker.all_finished(10))
+
+    def test_record_metrics(self):
+        worker = self.Worker.insert(pid=1)
+        worker.count_operation('Model.Wms.Operation.Move')
+        worker.count_metric('purchases', 3)
+        worker.add_phase_time('arrivals', 0.5)
+        worker.conflicts += 2
+        line = worker.record_metrics(timeslice=1)
+        self.assertEqual(line.worker_type, 'Regular')
+        self.assertEqual(line.timeslice, 1)
+        self.assertEqual(line.operations, {'Model.Wms.Operation.Move': 1})
+        self.assertEqual(line.counts, dict(purchases=3, conflicts=2))
+        self.assertEqual(line.phases, dict(arrivals=0.5))
+        # accumulated values are reset
+        self.assertEqual(worker.metrics,
+                         dict(operations={}, counts={}, phases={},
+                              conflict_sources={}))
+        self.assertEqual(worker.record_metrics().counts, dict(conflicts=0))
+
+    def test_conflict_table(self):
+        exc = OperationalError("SELECT wms_operation.id FROM wms_operation "
+                               "WHERE wms_operation.state = 'planned'",
+                               {}, Exception())
+        self.assertEqual(self.Worker.conflict_table(exc), 'wms_operation')
+        exc = OperationalError("COMMIT", {}, Exception())
+        self.assertEqual(self.Worker.conflict_table(exc), 'unknown')
+
+    def test_backoff_delay(self):
+        worker = self.Worker()
+        worker.conflict_streak = 1
+        self.assertLessEqual(worker.backoff_delay(), worker.retry_base_delay)
+        worker.conflict_streak = 100
+        self.assertLessEqual(worker.backoff_delay(), worker.retry_max_delay)
+
+    def test_handle_failure(self):
+        # not inserted, hence unaffected by rollbacks
+        worker = self.Worker(retry_max_attempts=3, retry_base_delay=0.)
+        self.assertTrue(worker.handle_failure(ValueError(), 'w', 'test'))
+        self.assertTrue(worker.handle_failure(ValueError(), 'w', 'test'))
+        self.assertFalse(worker.handle_failure(ValueError(), 'w', 'test'))
+        # streak has been reset
+        self.assertTrue(worker.handle_failure(ValueError(), 'w', 'test'))
+        worker.conflict_resolved()
+        self.assertEqual(worker.failure_streak, 0)
+
+    def test_retry_pending_batch_give_up(self):
+        # not inserted, hence unaffected by rollbacks
+        worker = self.Worker(retry_max_attempts=2, retry_base_delay=0.)
+
+        def conflicting(op_id):
+            raise OperationalError("SELECT", {},
+                                   TransactionRollbackError())
+
+        def failing(op_id):
+            raise ValueError(op_id)
+
+        worker.pending_batch = [1, 2]
+        self.assertEqual(worker.retry_pending_batch('w', execute=failing),
+                         [])
+        self.assertEqual(worker.given_up_operations, {1, 2})
+        self.assertEqual(worker.pending_batch, ())
+        worker.pending_batch = [3]
+        self.assertEqual(
+            worker.retry_pending_batch('w', execute=conflicting), [])
+        self.assertEqual(worker.given_up_operations, {1, 2, 3})
+        self.assertEqual(worker.conflicts, 2)
+
+        worker.pending_batch = [4]
+        self.assertEqual(worker.retry_pending_batch(
+            'w', execute=lambda op_id: ('Model.Wms.Operation.Move', op_id)),
+                         [('Model.Wms.Operation.Move', 4)])
+        self.assertEqual(worker.given_up_operations, {1, 2, 3})
+
+    def test_apply_phase_isolation(self):
+        worker = self.Worker()
+        worker.phase_isolation = dict(sales='READ COMMITTED')
+        executed = []
+        connection = SimpleNamespace(execute=executed.append)
+        session = self.registry.session
+        worker.current_phase = 'sales'
+        worker.apply_phase_isolation(session, None, connection)
+        self.assertEqual(executed,
+                         ["SET TRANSACTION ISOLATION LEVEL READ COMMITTED"])
+        worker.current_phase = 'execution'
+        worker.apply_phase_isolation(session, None, connection)
+        self.assertEqual(len(executed), 1)
+        # sessions of other threads are ignored
+        worker.current_phase = 'sales'
+        worker.apply_phase_isolation(object(), None, connection)
+        self.assertEqual(len(executed), 1)
+        # no transaction must be started while waiting for notifications
+        worker.waiting_notifications = True
+        worker.apply_phase_isolation(session, None, connection)
+        self.assertEqual(len(executed), 1)
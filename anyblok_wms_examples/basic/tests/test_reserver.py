@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Examples project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+from types import SimpleNamespace
+
+from sqlalchemy.exc import IntegrityError
+
+from anyblok_wms_base.testing import WmsTestCase
+
+from . import savepoint_commits
+
+
+class ReserverTestCase(WmsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        Wms = self.Wms = self.registry.Wms
+        self.Request = Wms.Reservation.Request
+        self.Reserver = Wms.Worker.Reserver
+        self.Sale = Wms.Example.Sale
+
+    def test_partition(self):
+        created = self.Sale.create_many([{}, {}, {}, {}])
+        req_ids = [req_id for _, req_id in created]
+        reserver = self.Reserver.insert(partition=1, partitions=2,
+                                        batch_size=10)
+        with savepoint_commits(self.registry):
+            self.assertEqual(reserver.process_one(),
+                             len([i for i in req_ids if i % 2 == 1]))
+
+        for req_id in req_ids:
+            self.assertEqual(self.Request.query().get(req_id).reserved,
+                             req_id % 2 == 1)
+
+    def test_no_partition(self):
+        self.assertIsNone(self.Reserver(partitions=1).partition_filter())
+
+    def test_is_reservation_clash(self):
+        def integrity_error(pgcode, table):
+            return IntegrityError(
+                "INSERT INTO %s (physobj_id) VALUES (1)" % table, {},
+                SimpleNamespace(pgcode=pgcode, diag=None))
+
+        is_clash = self.Reserver.is_reservation_clash
+        self.assertTrue(is_clash(integrity_error('23505', 'wms_reservation')))
+        # not a unique violation
+        self.assertFalse(is_clash(integrity_error('23503',
+                                                  'wms_reservation')))
+        self.assertFalse(is_clash(integrity_error('23505', 'wms_physobj')))
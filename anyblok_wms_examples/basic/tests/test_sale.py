@@ -19,3 +19,35 @@ class SaleTestCase(WmsTestCase):
     def test_create_random(self):
         sale, req = self.Sale.create_random()
         self.assertEqual(req.purpose, ['sale', sale.id])
+
+    def test_create_many(self):
+        Request = self.Wms.Reservation.Request
+        RequestItem = self.Wms.Reservation.RequestItem
+        all_contents = [{'JEANS/25/28': 2, 'JEANS/31/32': 1},
+                        {},
+                        {'JEANS/25/28': 2, 'JEANS/31/32': 1},
+                        {'JEANS/40/39': 3}]
+        created = self.Sale.create_many(all_contents)
+        self.assertEqual(len(created), 4)
+
+        contents = []
+        for sale_id, req_id in created:
+            sale = self.Sale.query().get(sale_id)
+            req = Request.query().get(req_id)
+            self.assertEqual(req.purpose, ['sale', sale_id])
+            self.assertFalse(req.reserved)
+            self.assertFalse(req.planned)
+            items = RequestItem.query().filter_by(request=req).all()
+            self.assertEqual(
+                {item.goods_type.code: item.quantity for item in items},
+                sale.contents)
+            contents.append(sale.contents)
+        self.assertEqual(sorted(contents, key=sorted),
+                         sorted(all_contents, key=sorted))
+
+    def test_create_many_empty(self):
+        self.assertEqual(self.Sale.create_many(()), [])
+
+    def test_create_random_batch(self):
+        created = self.Sale.create_random_batch(5)
+        self.assertEqual(len(created), 5)
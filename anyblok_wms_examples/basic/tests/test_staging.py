@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Examples project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import os
+import shutil
+import tempfile
+
+from anyblok_wms_base.testing import WmsTestCase
+
+from anyblok_wms_examples.workload import write_feed
+
+
+class WorkloadStagingTestCase(WmsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.Staging = self.registry.Wms.Example.WorkloadStaging
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.feed_path = os.path.join(tmpdir, 'feed.csv')
+
+    def test_load_pull(self):
+        write_feed(self.feed_path, [
+            (1, 0, 'purchase', {'JEANS/25/28': 2}),
+            (1, 0, 'sale', {'JEANS/25/28': 1}),
+            (1, 1, 'sale', {'JEANS/31/32': 3}),
+            (2, 0, 'sale', {}),
+            (1, 0, 'sale', {'JEANS/40/39': 1, 'JEANS/31/32': 2}),
+        ])
+        self.assertEqual(self.Staging.load_feed(self.feed_path), 5)
+        pull = self.Staging.pull
+        self.assertEqual(pull(0, 1, 'sale'),
+                         [{'JEANS/25/28': 1},
+                          {'JEANS/40/39': 1, 'JEANS/31/32': 2}])
+        self.assertEqual(pull(0, 1, 'sale'), [])
+        self.assertEqual(pull(0, 1, 'purchase'), [{'JEANS/25/28': 2}])
+        # late lines are pulled as well
+        self.assertEqual(pull(1, 2, 'sale'), [{'JEANS/31/32': 3}])
+        self.assertEqual(pull(0, 2, 'sale'), [{}])
+        self.assertEqual(self.Staging.query().count(), 0)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Examples project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+from anyblok_wms_base.testing import WmsTestCase
+
+from anyblok_wms_examples.basic import Seller
+
+
+class StockLevelTestCase(WmsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        Wms = self.Wms = self.registry.Wms
+        self.StockLevel = Wms.Example.StockLevel
+        self.Regular = Wms.Worker.Regular
+        self.Planner = Wms.Worker.Planner
+
+    def quantity(self, product):
+        return self.StockLevel.query().get(product).quantity
+
+    def test_lifecycle(self):
+        regular = self.Regular.insert()
+        planner = self.Planner.insert()
+        self.assertEqual(self.StockLevel.check_consistency(), [])
+
+        product = regular.purchase()[:-4]
+        self.assertEqual(self.quantity(product), 1)
+        self.assertEqual(self.StockLevel.check_consistency(), [])
+
+        planner.process_one()
+        # the Move doesn't change anything, the Unpack outcomes are there
+        # in the future, whereas the pack won't be anymore
+        self.assertEqual(self.quantity(product), 20)
+        self.assertEqual(self.StockLevel.check_consistency(), [])
+
+        Operation = self.Wms.Operation
+        for op in Operation.query().filter_by(state='planned').order_by(
+                Operation.id).all():
+            op.execute()
+        self.assertEqual(self.quantity(product), 20)
+        self.assertEqual(self.StockLevel.check_consistency(), [])
+
+    def test_new_type(self):
+        self.Wms.PhysObj.Type.insert(code='SHORTS/31', product='SHORTS/31')
+        self.assertEqual(self.quantity('SHORTS/31'), 0)
+        missing = [r[0] for r in self.registry.execute(
+            self.Regular.missing_product_query()).fetchall()]
+        self.assertIn('SHORTS/31', missing)
+
+    def test_rebuild(self):
+        self.registry.execute("UPDATE wms_example_stocklevel "
+                              "SET quantity = 3 WHERE product='JEANS/31/32'")
+        self.assertEqual(self.StockLevel.check_consistency(),
+                         [('JEANS/31/32', 0, 3)])
+        self.StockLevel.rebuild()
+        self.assertEqual(self.StockLevel.check_consistency(), [])
+
+    def test_seed(self):
+        self.assertEqual(self.StockLevel.seed(1), 400)
+        # only the difference gets created
+        self.assertEqual(self.StockLevel.seed(2, chunk_size=7), 400)
+        self.assertEqual(self.quantity('JEANS/31/32'), 2)
+        self.assertEqual(self.quantity('JEANS/25/20'), 2)
+        self.assertEqual(self.StockLevel.check_consistency(), [])
+        # the trigger, disabled during the COPY, is enabled again
+        self.assertEqual(self.registry.execute(
+            "SELECT tgenabled FROM pg_trigger "
+            "WHERE tgname = 'wms_example_stocklevel_avatar'").scalar(), 'O')
+        missing = self.registry.execute(
+            self.Regular.missing_product_query()).fetchall()
+        self.assertEqual(missing, [])
+
+        PhysObj = self.Wms.PhysObj
+        Avatar = PhysObj.Avatar
+        goods = PhysObj.query().join(PhysObj.type).filter_by(
+            code='JEANS/40/39').all()
+        self.assertEqual(len(goods), 2)
+        stock = PhysObj.query().filter_by(code='stock').one()
+        for obj in goods:
+            avatar = Avatar.query().filter_by(obj=obj).one()
+            self.assertEqual(avatar.location, stock)
+            self.assertEqual(avatar.state, 'present')
+
+        # already at the wished level
+        self.assertEqual(self.StockLevel.seed(2), 0)
+
+    def test_update_without_triggers(self):
+        StockLevel = self.StockLevel
+        self.assertTrue(StockLevel.triggers_installed())
+        self.registry.execute("DROP TRIGGER wms_example_stocklevel_avatar "
+                              "ON wms_physobj_avatar")
+        self.registry.execute("DELETE FROM wms_example_stocklevel")
+        self.assertFalse(StockLevel.triggers_installed())
+
+        Seller(self.registry).update('0.8.0.dev0')
+        self.assertTrue(StockLevel.triggers_installed())
+        self.assertEqual(StockLevel.check_consistency(), [])
+        self.assertEqual(self.quantity('JEANS/31/32'), 0)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Examples project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+from sqlalchemy import event
+
+from anyblok_wms_base.testing import WmsTestCase
+
+from . import savepoint_commits
+
+
+class LocationCacheTestCase(WmsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        Wms = self.Wms = self.registry.Wms
+        self.Worker = Wms.Worker.Regular
+        self.Worker.clear_location_cache()
+
+    def tearDown(self):
+        self.Worker.clear_location_cache()
+        super().tearDown()
+
+    def test_location_by_code(self):
+        worker = self.Worker()
+        stock = self.Wms.PhysObj.query().filter_by(code='stock').one()
+        self.assertEqual(worker.stock_location, stock)
+        self.assertEqual(
+            worker._locations[self.registry.db_name]['stock'].id, stock.id)
+        # cache is shared with other worker types
+        self.assertEqual(self.Wms.Worker.Planner().stock_location, stock)
+
+    def test_no_query(self):
+        worker = self.Worker()
+        stock_id = worker.stock_location.id
+        self.registry.session.expire_all()
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        bind = self.registry.session.connection()
+        event.listen(bind, 'before_cursor_execute', before_cursor_execute)
+        try:
+            stock = worker.stock_location
+            self.assertEqual(stock.id, stock_id)
+            self.assertEqual(stock.code, 'stock')
+            self.assertTrue(stock.is_container())
+        finally:
+            event.remove(bind, 'before_cursor_execute',
+                         before_cursor_execute)
+        self.assertEqual(statements, [])
+
+    def test_rollback(self):
+        worker = self.Worker()
+        with savepoint_commits(self.registry):
+            worker.incoming_location
+            self.registry.commit()
+            worker.outgoing_location
+            self.registry.rollback()
+        cache = worker._locations[self.registry.db_name]
+        self.assertIn('incoming', cache)
+        self.assertNotIn('outgoing', cache)
+        self.assertEqual(worker.outgoing_location.code, 'outgoing')
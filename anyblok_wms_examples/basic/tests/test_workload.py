@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Examples project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import csv
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from anyblok_wms_examples.workload import FEED_COLUMNS
+from anyblok_wms_examples.workload import Workload
+from anyblok_wms_examples.workload import feed_rows
+from anyblok_wms_examples.workload import open_feed
+from anyblok_wms_examples.workload import write_feed
+
+PRODUCTS = ['JEANS/%d/%d' % (w, h)
+            for w in range(25, 45) for h in range(20, 40)]
+
+
+class WorkloadTestCase(TestCase):
+
+    def draw(self, workload, count=50):
+        return [workload.sale_contents() for _ in range(count)]
+
+    def test_reproducible(self):
+        def workload(stream):
+            return Workload.from_scenario('zipf', seed=12, stream=stream,
+                                          products=PRODUCTS)
+        self.assertEqual(self.draw(workload(1)), self.draw(workload(1)))
+        self.assertNotEqual(self.draw(workload(1)), self.draw(workload(2)))
+
+    def test_popularity_shared_by_streams(self):
+        workloads = [Workload(seed=3, stream=i, products=PRODUCTS)
+                     for i in range(2)]
+        self.assertEqual(workloads[0].products, workloads[1].products)
+
+    def test_zero_weights(self):
+        workload = Workload(seed=1, products=PRODUCTS,
+                            lines_weights=[0, 0, 1],
+                            quantity_weights=[0, 1])
+        for contents in self.draw(workload):
+            self.assertEqual(sum(contents.values()), 4)
+
+    def test_zipf_skew(self):
+        workload = Workload(seed=1, products=PRODUCTS, zipf_exponent=2,
+                            lines_weights=[0, 1])
+        counts = {}
+        for contents in self.draw(workload, count=1000):
+            for product in contents:
+                counts[product] = counts.get(product, 0) + 1
+        # the most popular product has 1 / zeta(2) ~ 0.61 of probability
+        self.assertGreater(counts[workload.products[0]], 500)
+
+    def test_unknown_scenario(self):
+        with self.assertRaises(KeyError):
+            Workload.from_scenario('no such scenario')
+
+    def test_purchase_contents(self):
+        workload = Workload(seed=1, products=PRODUCTS)
+        self.assertEqual(sum(workload.purchase_contents(7).values()), 7)
+
+    def test_write_feed(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        workloads = [Workload(seed=5, stream=i, products=PRODUCTS)
+                     for i in range(2)]
+        rows = list(feed_rows(workloads, 3, 4, purchases_per_timeslice=2))
+        self.assertEqual(len(rows), 3 * 2 * (4 + 1))
+
+        for fname in ('feed.csv', 'feed.csv.gz'):
+            path = os.path.join(tmpdir, fname)
+            self.assertEqual(write_feed(path, rows), len(rows))
+            with open_feed(path) as feed_file:
+                reader = csv.reader(feed_file)
+                self.assertEqual(tuple(next(reader)), FEED_COLUMNS)
+                self.assertEqual(
+                    [(int(tsl), int(stream), kind, json.loads(contents))
+                     for tsl, stream, kind, contents in reader],
+                    rows)
@@ -6,7 +6,17 @@
 # This Source Code Form is subject to the terms of the Mozilla Public License,
 # v. 2.0. If a copy of the MPL was not distributed with this file,You can
 # obtain one at http://mozilla.org/MPL/2.0/.
+import logging
+
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
 from anyblok import Declarations
+from anyblok.common import anyblok_column_prefix
+
+logger = logging.getLogger(__name__)
 register = Declarations.register
 Wms = Declarations.Model.Wms
 
@@ -16,20 +26,92 @@ class WmsBasicSellerUtil:
 
     # I'm actually tempted to set in on the Blok itself !
 
+    _locations = {}
+    """Cache of locations, by database name, then by code.
+
+    Locations are created once and for all at installation, so that they
+    can be kept for the whole life of the process. The cached objects are
+    detached copies, holding the ids and column values of the locations
+    and of their Types, see :meth:`location_by_code`.
+    """
+
+    @classmethod
+    def detached_copy(cls, record):
+        """Return a detached copy of ``record`` with its column values.
+
+        The copy isn't tied to any session, hence isn't expired at the end
+        of transactions.
+        """
+        mapper = sqlalchemy.inspect(record).mapper
+        copy = mapper.class_manager.new_instance()
+        for attr in mapper.column_attrs:
+            set_committed_value(copy, attr.key, getattr(record, attr.key))
+        make_transient_to_detached(copy)
+        return copy
+
     def location_by_code(self, code):
-        return self.registry.Wms.PhysObj.query().filter_by(code=code).one()
+        """Return the location with given code, using the per process cache.
+
+        The cached copy is merged into the current session without any
+        query, together with its Type (enough to create Operations).
+        If the transaction in which a location got cached is rolled back,
+        the cache entry is discarded, as the location may have been
+        created by that transaction.
+        """
+        db_name = self.registry.db_name
+        cache = self._locations.setdefault(db_name, {})
+        cached = cache.get(code)
+        if cached is not None:
+            return self.registry.session.merge(cached, load=False)
+
+        location = self.registry.Wms.PhysObj.query().filter_by(
+            code=code).one()
+        cached = self.detached_copy(location)
+        set_committed_value(cached, anyblok_column_prefix + 'type',
+                            self.detached_copy(location.type))
+        cache[code] = cached
+
+        ended = []
+
+        def transaction_end(session, *args):
+            if ended:
+                return
+            ended.append(True)
+            if args:  # rollback
+                cache.pop(code, None)
+                logger.info("Discarded cached location %r, loaded in a "
+                            "transaction that has been rolled back", code)
+
+        event.listen(self.registry.session, 'after_commit',
+                     transaction_end, once=True)
+        event.listen(self.registry.session, 'after_soft_rollback',
+                     transaction_end, once=True)
+        return location
+
+    @classmethod
+    def clear_location_cache(cls):
+        """Forget about all cached locations of the current database."""
+        cls._locations.pop(cls.registry.db_name, None)
 
     @property
     def incoming_location(self):
-        # TODO cache
         return self.location_by_code("incoming")
 
     @property
     def stock_location(self):
-        # TODO cache
         return self.location_by_code("stock")
 
     @property
     def outgoing_location(self):
-        # TODO cache
         return self.location_by_code("outgoing")
+
+    def next_ids(self, model, count):
+        """Draw ``count`` values from the sequence of ``model`` primary key.
+
+        This allows to insert related records in bulk, without relying
+        on the ordering of ``INSERT ... RETURNING`` results.
+        """
+        return [r[0] for r in self.registry.execute(
+            "SELECT nextval(pg_get_serial_sequence(:table, 'id')) "
+            "FROM generate_series(1, :count)",
+            dict(table=model.__table__.name, count=count)).fetchall()]
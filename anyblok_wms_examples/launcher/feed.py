@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Examples project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""Generation and loading of workload feed files.
+
+Generating the workload beforehand takes its cost out of the measured
+transactions. The feed is then loaded in the staging table with ``COPY``,
+and the launcher, run with ``--workload-feed``, makes regular workers
+pull their share from there.
+"""
+import logging
+import sys
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+import anyblok
+
+from ..workload import DEFAULT_SCENARIO
+from ..workload import SCENARIOS
+from ..workload import Workload
+from ..workload import feed_rows
+from ..workload import load_scenarios
+from ..workload import write_feed
+
+logger = logging.getLogger(__name__)
+
+
+def start_registry():
+    registry = anyblok.start('feed', configuration_groups=[],
+                             loadwithoutmigration=True)
+    if registry is None:
+        logging.critical("wms_example_feed: couldn't init registry")
+        sys.exit(1)
+    return registry
+
+
+def read_products(path):
+    """Read product codes, one per line, ignoring empty lines."""
+    with open(path) as products_file:
+        return [line.strip() for line in products_file if line.strip()]
+
+
+def generate(arguments):
+    if arguments.products_file:
+        products = read_products(arguments.products_file)
+    else:
+        registry = start_registry()
+        products = registry.Wms.PhysObj.Type.all_products()
+        registry.rollback()
+    workloads = [Workload.from_scenario(arguments.scenario,
+                                        seed=arguments.seed,
+                                        stream=stream,
+                                        products=products)
+                 for stream in range(arguments.regular_workers)]
+    count = write_feed(arguments.path, feed_rows(
+        workloads, arguments.timeslices, arguments.sales_per_timeslice,
+        purchases_per_timeslice=arguments.purchases_per_timeslice))
+    logger.info("Wrote %d rows to %r", count, arguments.path)
+
+
+def load(arguments):
+    registry = start_registry()
+    Staging = registry.Wms.Example.WorkloadStaging
+    if arguments.replace:
+        Staging.query().delete(synchronize_session=False)
+    Staging.load_feed(arguments.path)
+    registry.commit()
+
+
+def run():
+    parser = ArgumentParser(
+        description="Generate workload feed files, or load them for "
+        "replay by the regular workers",
+        formatter_class=ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    gen_parser = subparsers.add_parser(
+        'generate', help="Write a feed file",
+        formatter_class=ArgumentDefaultsHelpFormatter)
+    gen_parser.add_argument("path",
+                            help="Path to the feed file. It gets "
+                            "compressed if it ends with .gz")
+    gen_parser.add_argument("--timeslices", type=int, default=10)
+    gen_parser.add_argument("--regular-workers", type=int, default=4,
+                            help="Number of streams to generate. Must "
+                            "match the number of regular workers of the "
+                            "run replaying the feed")
+    gen_parser.add_argument("--sales-per-timeslice", type=int, default=10,
+                            help="Number of sales per timeslice and per "
+                            "regular worker")
+    gen_parser.add_argument("--purchases-per-timeslice", type=int,
+                            default=0,
+                            help="Number of packs each regular worker "
+                            "purchases at the beginning of timeslices, on "
+                            "top of the ones for missing products")
+    gen_parser.add_argument("--seed", type=int)
+    gen_parser.add_argument("--scenario", default=DEFAULT_SCENARIO,
+                            help="Name of the workload scenario. "
+                            "Presets: %s" % ', '.join(sorted(SCENARIOS)))
+    gen_parser.add_argument("--scenario-file",
+                            help="JSON file defining additional scenarios")
+    gen_parser.add_argument("--products-file",
+                            help="File listing the product codes, one per "
+                            "line. If not specified, they are read from "
+                            "the database")
+    gen_parser.set_defaults(func=generate)
+
+    load_parser = subparsers.add_parser(
+        'load', help="Load a feed file in the staging table",
+        formatter_class=ArgumentDefaultsHelpFormatter)
+    load_parser.add_argument("path", help="Path to the feed file")
+    load_parser.add_argument("--replace", action='store_true',
+                             help="Empty the staging table first")
+    load_parser.set_defaults(func=load)
+
+    logging.basicConfig(level=logging.INFO)
+    arguments, anyblok_argv = parser.parse_known_args()
+    sys.argv[1:] = anyblok_argv
+    if getattr(arguments, 'scenario_file', None):
+        load_scenarios(arguments.scenario_file)
+    if (arguments.command == 'generate' and
+            arguments.scenario not in SCENARIOS):
+        parser.error("Unknown scenario %r. Available: %s" % (
+            arguments.scenario, ', '.join(sorted(SCENARIOS))))
+    arguments.func(arguments)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Examples project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""Reception of PostgreSQL notifications.
+
+``LISTEN`` is tied to the server session. Behind a transaction pooler,
+such as PgBouncer in transaction pooling mode, successive transactions
+of a worker can be handled by different server sessions, therefore
+notifications have to be received on a dedicated connection, that
+doesn't go through the pooler.
+"""
+import logging
+import select
+from copy import copy
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+
+logger = logging.getLogger(__name__)
+
+
+def poll_notifications(conn, timeout):
+    """Wait for notifications on a psycopg2 connection, and consume them.
+
+    :param float timeout: maximal time to wait, in seconds
+    :return: list of notifications, empty if timeout expired
+    """
+    # notifications may have been read along with results of
+    # previous queries, in which case the socket won't be readable
+    conn.poll()
+    if not conn.notifies:
+        if select.select([conn], [], [], timeout) == ([], [], []):
+            return []
+        conn.poll()
+    notifies = list(conn.notifies)
+    del conn.notifies[:]
+    return notifies
+
+
+class Listener:
+    """A dedicated connection in autocommit mode, to receive notifications.
+    """
+
+    def __init__(self, url):
+        self.engine = create_engine(url, poolclass=NullPool)
+        self.raw_connection = self.engine.raw_connection()
+        self.connection = self.raw_connection.connection
+        self.connection.autocommit = True
+
+    @classmethod
+    def from_configuration(cls, host=None, port=None):
+        """Connect to the database of the AnyBlok configuration.
+
+        :param host: if specified, overrides the configured host, typically
+                     to bypass a transaction pooler.
+        :param port: same as ``host``, for the port.
+        """
+        from anyblok.config import Configuration, get_url
+        url = copy(get_url(db_name=Configuration.get('db_name')))
+        if host is not None:
+            url.host = host
+        if port is not None:
+            url.port = port
+        logger.info("Opening dedicated listening connection to %s:%s",
+                    url.host, url.port)
+        return cls(url)
+
+    def listen(self, *channels):
+        """Subscribe to the given channels. This takes effect immediately."""
+        with self.connection.cursor() as cr:
+            for channel in channels:
+                cr.execute("LISTEN %s" % channel)
+
+    def wait(self, timeout):
+        """Same as :func:`poll_notifications` on the dedicated connection."""
+        return poll_notifications(self.connection, timeout)
+
+    def close(self):
+        self.raw_connection.close()
+        self.engine.dispose()
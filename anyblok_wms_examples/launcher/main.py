@@ -7,27 +7,159 @@
 # v. 2.0. If a copy of the MPL was not distributed with this file,You can
 # obtain one at http://mozilla.org/MPL/2.0/.
 import os
+import random
 import sys
 import anyblok
 import logging
 import time
-from multiprocessing import Process
+import multiprocessing
+import threading
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from argparse import ArgumentTypeError
 from sqlalchemy import func
 
+from ..workload import SCENARIOS
+from ..workload import DEFAULT_SCENARIO
+from ..workload import Workload
+from ..workload import load_scenarios
+from .listener import Listener
+from .summary import collect_results
+from .summary import output_summary
+from .summary import summarize
+
 
 logger = logging.getLogger('multi')
 
 DEFAULT_ISOLATION = 'REPEATABLE READ'  # 'SERIALIZABLE'
 
+ISOLATION_LEVELS = ('READ COMMITTED', 'REPEATABLE READ', 'SERIALIZABLE')
+
+REGULAR_PHASES = ('arrivals', 'purchases', 'sales', 'execution')
+"""Phases of regular workers that can have their own isolation level."""
+
+PHASES = REGULAR_PHASES + ('planner', 'reserver')
+"""Phases that can have their own isolation level.
+
+For continuous workers, the phase is simply the worker type.
+"""
+
+
+class RegistryInitError(RuntimeError):
+    """Raised by worker functions if they can't get their registry.
+
+    In threads mode, :func:`threads_process` reports it, instead of just
+    the worker thread ending silently.
+    """
+
+
+def parse_isolation_level(value):
+    """Normalize an isolation level from the command line."""
+    level = value.replace('_', ' ').replace('-', ' ').upper()
+    if level not in ISOLATION_LEVELS:
+        raise ArgumentTypeError("Unknown isolation level %r" % value)
+    return level
+
+
+def parse_phase_isolation(value):
+    """Parse a ``PHASE=LEVEL`` isolation override.
+
+    :rtype: tuple
+    """
+    phase, sep, level = value.partition('=')
+    phase = phase.strip().lower()
+    if not sep or phase not in PHASES:
+        raise ArgumentTypeError(
+            "Expected PHASE=LEVEL, with PHASE among %s, got %r" % (
+                ', '.join(PHASES), value))
+    return phase, parse_isolation_level(level)
+
+
+def make_listener(arguments, threaded=False):
+    """Open a dedicated listening connection if needed.
 
-def regular_worker(arguments):
-    registry = anyblok.start('basic', configuration_groups=[],
-                             loadwithoutmigration=True,
-                             isolation_level=DEFAULT_ISOLATION)
+    This has to be called after the registry initialization, so that the
+    database configuration is known.
+
+    :param bool threaded: if ``True``, the connection is always opened:
+                          worker threads share the connection pool, so
+                          that a ``LISTEN`` issued on the connection of
+                          the session would end up being consumed by any
+                          of them.
+    :return: ``None`` if notifications are to be received on the
+             connection of the session.
+    """
+    if not (threaded or arguments.dedicated_listener or
+            arguments.listener_db_host or arguments.listener_db_port):
+        return None
+    return Listener.from_configuration(host=arguments.listener_db_host,
+                                       port=arguments.listener_db_port)
+
+
+def load_registry(isolation_level):
+    return anyblok.start('basic', configuration_groups=[],
+                         loadwithoutmigration=True,
+                         isolation_level=isolation_level)
+
+
+def prepare_prefork(registry):
+    """Release all connections of a registry about to be shared by forking.
+    """
+    registry.rollback()
+    registry.engine.dispose()
+
+
+def init_registry(arguments, isolation_level, registry=None,
+                  threaded=False):
+    """Provide the registry of a worker process.
+
+    :param registry: a registry loaded by the parent process before forking
+                     (see :func:`prepare_prefork`). Only the connections
+                     are initialized, and the isolation level applied.
+                     If ``None``, a new registry is loaded.
+    :param bool threaded: if ``True``, ``registry`` is shared by
+                          several worker threads, and already
+                          initialized for the current process. The
+                          isolation level is not applied.
+    """
     if registry is None:
-        logging.critical("regular_worker: couldn't init registry")
-        sys.exit(1)
+        return load_registry(isolation_level)
+    if threaded:
+        return registry
+    # never share connections with the parent or the other children
+    registry.engine.dispose()
+    if isolation_level != arguments.isolation:
+        registry.engine.update_execution_options(
+            isolation_level=isolation_level)
+    return registry
+
+
+def make_workload(number, arguments):
+    """Instantiate the seeded workload generator of a regular worker.
+
+    :param int number: the number of the worker, used as its random stream
+    """
+    if arguments.scenario_file:
+        # in case worker processes are not forked
+        load_scenarios(arguments.scenario_file)
+    return Workload.from_scenario(arguments.scenario, seed=arguments.seed,
+                                  stream=number)
+
+
+def regular_worker(number, arguments, results, registry=None,
+                   launched=None, threaded=False):
+    """Run a regular worker.
+
+    :param int number: the number of the worker, among regular workers
+    :param registry: see :func:`init_registry`
+    :param float launched: time of the launch of the whole run, used to
+                           measure startup and time to first operation.
+    :param threaded: see :func:`init_registry`
+    """
+    registry = init_registry(arguments, arguments.isolation,
+                             registry=registry, threaded=threaded)
+    if registry is None:
+        raise RegistryInitError("regular_worker: couldn't init registry")
+    ready = time.time()
 
     Worker = registry.Wms.Worker.Regular
     previous_run_timeslice = Worker.query(
@@ -41,34 +173,89 @@ def regular_worker(arguments):
         active=True,
         done_timeslice=previous_run_timeslice,
         max_timeslice=previous_run_timeslice + timeslices,
+        batch_size=arguments.batch_size,
+        sales_per_timeslice=arguments.sales_per_timeslice,
         )
+    overrides = {phase: level
+                 for phase, level in arguments.phase_isolation or ()
+                 if phase in REGULAR_PHASES}
+    if overrides:
+        process.install_phase_isolation(overrides)
+    process.listener = make_listener(arguments, threaded=threaded)
+    process.workload = make_workload(number, arguments)
+    if arguments.workload_feed:
+        process.feed_stream = number
+        process.feed_offset = previous_run_timeslice
 
+    operations = 0
+    durations = []
+    barrier_waits = []
     for i in range(1, 1 + timeslices):
         registry.commit()
+        start = time.time()
         try:
-            process.run_timeslice()
+            operations += process.run_timeslice()
         except KeyboardInterrupt:
             process.stop()
             break
-        process.wait_others(i)
+        except Exception:
+            # otherwise the other regular workers would wait for us forever
+            logger.exception("%s, stopping after unexpected exception",
+                             process)
+            process.stop()
+            raise
+        durations.append(time.time() - start)
+        barrier_waits.append(process.wait_others(previous_run_timeslice + i))
     registry.commit()
+    if process.listener is not None:
+        process.listener.close()
+    results.put(dict(worker_type='Regular',
+                     pid=os.getpid(),
+                     worker_id=process.id,
+                     operations=operations,
+                     conflicts=process.conflicts,
+                     conflict_sources=process.conflict_sources or {},
+                     spins=process.spins,
+                     timeslice_durations=durations,
+                     barrier_waits=barrier_waits,
+                     **startup_times(process, launched, ready)))
+
+
+def startup_times(process, launched, ready):
+    """Measure the startup times of a worker, for its final results.
+
+    :param float launched: see :func:`regular_worker`
+    :param float ready: time at which the registry was available
+    :rtype: dict
+    """
+    if launched is None:
+        return {}
+    first_work = process.first_work_time
+    return dict(startup_time=ready - launched,
+                time_to_first_operation=(None if first_work is None
+                                         else first_work - launched))
 
 
-def continuous(wtype, arguments,
-               isolation_level=DEFAULT_ISOLATION, cleanup=False):
+def continuous(wtype, arguments, results,
+               isolation_level=DEFAULT_ISOLATION, cleanup=False,
+               registry=None, launched=None, threaded=False, **fields):
     """Start a continuous worker.
 
+    :param results: queue to put the final statistics in.
+    :param registry: see :func:`init_registry`
+    :param launched: see :func:`regular_worker`
+    :param threaded: see :func:`init_registry`
     :param bool cleanup: if ``True`` remove all existing records of
                          the same worker type. They are considered stale
                          from previous runs.
+    :param fields: passed over to the worker record, e.g, ``batch_size``
     """
-    registry = anyblok.start('basic', configuration_groups=[],
-                             loadwithoutmigration=True,
-                             isolation_level=DEFAULT_ISOLATION)
+    registry = init_registry(arguments, isolation_level, registry=registry,
+                             threaded=threaded)
     if registry is None:
-        logging.critical("continuous worker(type=%s): couldn't init registry",
-                         wtype)
-        sys.exit(1)
+        raise RegistryInitError(
+            "continuous worker(type=%s): couldn't init registry" % wtype)
+    ready = time.time()
 
     Worker = getattr(registry.Wms.Worker, wtype)
     if cleanup:
@@ -77,26 +264,117 @@ def continuous(wtype, arguments,
         Worker.query().delete()
         registry.commit()
 
-    process = Worker.insert(pid=os.getpid())
+    process = Worker.insert(pid=os.getpid(), **fields)
     registry.commit()
-    while not process.should_proceed():
+    if threaded and isolation_level != arguments.isolation:
+        # the engine is shared with other threads
+        process.install_phase_isolation({None: isolation_level})
+    process.listener = make_listener(arguments, threaded=threaded)
+    process.listen()
+    while not process.should_proceed(refresh=True):
         logger.info("Regular workers not yet running. Waiting a bit")
-        time.sleep(0.1)
+        process.wait_notification(0.1)
         registry.rollback()
 
+    start = time.time()
     process.run()
+    if process.listener is not None:
+        process.listener.close()
+    results.put(dict(worker_type=wtype,
+                     pid=os.getpid(),
+                     worker_id=process.id,
+                     processed=process.processed,
+                     conflicts=process.conflicts,
+                     conflict_sources=process.conflict_sources or {},
+                     duration=time.time() - start,
+                     **startup_times(process, launched, ready)))
+
+
+def continuous_isolation(arguments, phase):
+    """Isolation level for a continuous worker type, with overrides applied.
+    """
+    overrides = dict(arguments.phase_isolation or ())
+    return overrides.get(phase, arguments.isolation)
 
 
-def reserver(arguments):
-    return continuous('Reserver', arguments, cleanup=True)
+def reserver(number, arguments, results, **kwargs):
+    return continuous('Reserver', arguments, results, cleanup=(number == 0),
+                      isolation_level=continuous_isolation(arguments,
+                                                           'reserver'),
+                      batch_size=arguments.reserver_batch_size,
+                      partition=number,
+                      partitions=arguments.reserver_workers,
+                      **kwargs)
 
 
-def planner(number, arguments):
-    return continuous('Planner', arguments, cleanup=(number == 0))
+def planner(number, arguments, results, **kwargs):
+    return continuous('Planner', arguments, results, cleanup=(number == 0),
+                      isolation_level=continuous_isolation(arguments,
+                                                           'planner'),
+                      batch_size=arguments.planner_batch_size,
+                      **kwargs)
 
 
-class Arguments:
-    pass
+def run_thread(target, args, kwargs, failures):
+    """Run a worker function, recording its exception if it fails.
+
+    :param list failures: the exception is appended to it.
+    """
+    try:
+        target(*args, **kwargs)
+    except Exception as exc:
+        logger.exception("Worker thread %s failed",
+                         threading.current_thread().name)
+        failures.append(exc)
+
+
+def threads_process(workers, arguments, results, registry=None,
+                    launched=None):
+    """Run several workers as threads of a single process.
+
+    Each thread has its own session, hence its own connection.
+    If any worker fails, the process exits with a non zero code once all
+    threads are finished, so that the launcher reports it.
+
+    :param workers: list of ``(target, args)`` pairs, where ``target`` is
+                    a worker function, such as :func:`regular_worker`.
+                    The keyword arguments for the registry are added.
+    :param registry: see :func:`init_registry`
+    """
+    registry = init_registry(arguments, arguments.isolation,
+                             registry=registry)
+    if registry is None:
+        logging.critical("threads_process: couldn't init registry")
+        sys.exit(1)
+    failures = []
+    threads = [threading.Thread(target=run_thread,
+                                args=(target, args,
+                                      dict(registry=registry,
+                                           launched=launched,
+                                           threaded=True),
+                                      failures))
+               for target, args in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if failures:
+        logging.critical("threads_process: %d of %d worker threads failed",
+                         len(failures), len(threads))
+        sys.exit(1)
+
+
+def threads_per_process(arguments):
+    """Number of worker threads in the most loaded process of threads mode.
+
+    This is 1 in processes mode.
+    """
+    if arguments.mode != 'threads':
+        return 1
+    nb_workers = (arguments.regular_workers + arguments.reserver_workers +
+                  arguments.planner_workers)
+    nb_procs = max(1, min(arguments.processes, nb_workers))
+    return max(1, -(-nb_workers // nb_procs))
 
 
 def run():
@@ -111,23 +389,141 @@ def run():
                         help="Number of regular worker processes to run. "
                         "in a normal application, these would be the ones "
                         "reacting to external events (bus, HTTP requests)")
+    parser.add_argument("--reserver-workers", type=int, default=1,
+                        help="Number of reserver worker processes to run")
+    parser.add_argument("--reserver-batch-size", type=int, default=1,
+                        help="Number of Reservation Requests that reserver "
+                        "workers lock at once")
+    parser.add_argument("--sales-per-timeslice", type=int, default=10,
+                        help="Number of sales that each regular worker "
+                        "issues at the beginning of each timeslice")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="Maximum number of Operations that regular "
+                        "workers execute in a single transaction")
+    parser.add_argument("--planner-batch-size", type=int, default=1,
+                        help="Maximum number of Reservation Requests that "
+                        "planner workers plan in a single transaction")
+    parser.add_argument("--isolation", type=parse_isolation_level,
+                        default=DEFAULT_ISOLATION,
+                        help="Default transaction isolation level, "
+                        "among %s" % ', '.join(ISOLATION_LEVELS))
+    parser.add_argument("--phase-isolation", type=parse_phase_isolation,
+                        action='append', metavar='PHASE=LEVEL',
+                        help="Isolation level override for a given phase, "
+                        "among %s. Can be repeated, for instance "
+                        "--phase-isolation sales='READ COMMITTED'" % (
+                            ', '.join(PHASES)))
+    parser.add_argument("--max-connections-per-worker", type=int,
+                        help="Bound the connection pool of each worker. "
+                        "This is a shortcut for AnyBlok's "
+                        "--db-pool-size and --db-max-overflow=0. In "
+                        "threads mode, the pool of each process is sized "
+                        "for all of its worker threads. "
+                        "Dedicated listening connections don't count.")
+    parser.add_argument("--dedicated-listener", action='store_true',
+                        help="Receive notifications on dedicated "
+                        "connections. This is necessary if workers "
+                        "connect through a transaction pooler such as "
+                        "PgBouncer in transaction pooling mode. "
+                        "Implied in threads mode.")
+    parser.add_argument("--listener-db-host",
+                        help="Host for the dedicated listening connections, "
+                        "typically to bypass the transaction pooler. "
+                        "Implies --dedicated-listener.")
+    parser.add_argument("--listener-db-port", type=int,
+                        help="Port for the dedicated listening connections. "
+                        "Implies --dedicated-listener.")
+    parser.add_argument("--prefork", action='store_true',
+                        help="Load the registry once in the launcher "
+                        "process, then fork workers, instead of having "
+                        "each worker load it")
+    parser.add_argument("--mode", choices=('processes', 'threads'),
+                        default='processes',
+                        help="Run each worker in its own process, or as "
+                        "threads of fewer processes")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="In threads mode, number of processes to "
+                        "spread the worker threads on")
+    parser.add_argument("--seed", type=int,
+                        help="Seed for the workload generation. If not "
+                        "specified, one is drawn and recorded in the "
+                        "summary, so that the run can be reproduced")
+    parser.add_argument("--scenario", default=DEFAULT_SCENARIO,
+                        help="Name of the workload scenario. "
+                        "Presets: %s" % ', '.join(sorted(SCENARIOS)))
+    parser.add_argument("--scenario-file",
+                        help="JSON file defining additional scenarios, "
+                        "see the anyblok_wms_examples.workload module")
+    parser.add_argument("--workload-feed", action='store_true',
+                        help="Regular workers pull their sales and "
+                        "scheduled purchases from the feed previously "
+                        "loaded with wms_example_feed, instead of "
+                        "generating sales")
+    parser.add_argument("--summary-file",
+                        help="Write the final JSON summary in this file "
+                        "instead of the standard output")
 
     logging.basicConfig(level=logging.INFO)
-#    arguments = parser.parse_args()
-    arguments = Arguments()
-    arguments.regular_workers = 4
-    arguments.timeslices = 10
-    arguments.planner_workers = 2
+    arguments, anyblok_argv = parser.parse_known_args()
+    # anyblok.start() parses the command line again in worker processes,
+    # and would choke on our own arguments
+    if arguments.max_connections_per_worker is not None:
+        # the pool is for the whole process, shared by its worker threads
+        anyblok_argv.extend((
+            '--db-pool-size', str(arguments.max_connections_per_worker *
+                                  threads_per_process(arguments)),
+            '--db-max-overflow', '0'))
+    sys.argv[1:] = anyblok_argv
+    if arguments.scenario_file:
+        load_scenarios(arguments.scenario_file)
+    if arguments.scenario not in SCENARIOS:
+        parser.error("Unknown scenario %r. Available: %s" % (
+            arguments.scenario, ', '.join(sorted(SCENARIOS))))
+    if arguments.seed is None:
+        arguments.seed = random.randrange(2 ** 31)
+    logger.info("Workload scenario %r, with seed %d",
+                arguments.scenario, arguments.seed)
 
+    start = time.time()
+    worker_kwargs = dict(launched=start)
+    if arguments.prefork:
+        # the registry gets passed to children as is, without pickling
+        context = multiprocessing.get_context('fork')
+        registry = load_registry(arguments.isolation)
+        if registry is None:
+            logging.critical("Couldn't init registry")
+            sys.exit(1)
+        prepare_prefork(registry)
+        worker_kwargs['registry'] = registry
+        logger.info("Registry loaded in %.3f seconds, now forking workers",
+                    time.time() - start)
+    else:
+        context = multiprocessing.get_context()
+    Process = context.Process
+
+    results = context.Queue()
     # starting regular workers right away, otherwise continuous workers
     # would believe the test/bench run is already finished.
-    for process in (Process(target=regular_worker, args=(arguments, ))
-                    for i in range(arguments.regular_workers)):
+    workers = [(regular_worker, (i, arguments, results))
+               for i in range(arguments.regular_workers)]
+    workers.extend((reserver, (i, arguments, results))
+                   for i in range(arguments.reserver_workers))
+    workers.extend((planner, (i, arguments, results))
+                   for i in range(arguments.planner_workers))
+    if arguments.mode == 'threads':
+        nb_procs = max(1, min(arguments.processes, len(workers)))
+        processes = [Process(target=threads_process,
+                             args=(workers[i::nb_procs], arguments, results),
+                             kwargs=worker_kwargs)
+                     for i in range(nb_procs)]
+    else:
+        processes = [Process(target=target, args=args, kwargs=worker_kwargs)
+                     for target, args in workers]
+    for process in processes:
         process.start()
 
-    Process(target=reserver, args=(arguments, )).start()
-
-    planners = [Process(target=planner, args=(i, arguments, ))
-                for i in range(arguments.planner_workers)]
-    for process in planners:
-        process.start()
+    worker_results = collect_results(results, processes,
+                                     expected=len(workers))
+    output_summary(summarize(arguments, time.time() - start,
+                             worker_results, processes=processes),
+                   path=arguments.summary_file)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Examples project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""Initial stock seeding, for benches starting in a steady state.
+
+Without it, the first timeslices of a run mostly measure purchases of
+missing products.
+"""
+import logging
+import sys
+import time
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+import anyblok
+
+logger = logging.getLogger(__name__)
+
+
+def run():
+    parser = ArgumentParser(
+        description="Bring the stock of all products up to a given level",
+        formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--per-product", type=int, default=40,
+                        help="Wished number of present and future goods "
+                        "for each product, packs included")
+    parser.add_argument("--location", default='stock',
+                        help="Code of the location of the created goods")
+    parser.add_argument("--chunk-size", type=int, default=1000,
+                        help="Number of products per COPY statement")
+
+    logging.basicConfig(level=logging.INFO)
+    arguments, anyblok_argv = parser.parse_known_args()
+    sys.argv[1:] = anyblok_argv
+
+    registry = anyblok.start('seed', configuration_groups=[],
+                             loadwithoutmigration=True)
+    if registry is None:
+        logging.critical("wms_example_seed: couldn't init registry")
+        sys.exit(1)
+
+    start = time.time()
+    created = registry.Wms.Example.StockLevel.seed(
+        arguments.per_product, location_code=arguments.location,
+        chunk_size=arguments.chunk_size)
+    registry.commit()
+    logger.info("Created %d goods in %.3f seconds",
+                created, time.time() - start)
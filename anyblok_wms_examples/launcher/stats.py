@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Examples project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""Live aggregation of the metrics recorded by workers.
+
+This reads the ``Wms.Worker.Metrics`` lines, either periodically while a
+bench is running, or all at once afterwards.
+"""
+import json
+import logging
+import sys
+import time
+from datetime import timedelta
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+import anyblok
+
+logger = logging.getLogger(__name__)
+
+
+def merge_sums(target, values):
+    """Add the numeric values of a dict to the ones of ``target``."""
+    for key, value in (values or {}).items():
+        target[key] = target.get(key, 0) + value
+
+
+def aggregate(lines):
+    """Sum up Metrics lines by worker type.
+
+    :param lines: iterable of ``Wms.Worker.Metrics`` instances
+    :return: dict whose keys are worker types, and values are dicts
+             with the same keys as the Metrics JSON columns, plus
+             ``lines``, ``workers`` (number of distinct processes),
+             ``duration`` (total over all processes) and ``timeslices``.
+    """
+    stats = {}
+    workers = {}
+    for line in lines:
+        wstats = stats.get(line.worker_type)
+        if wstats is None:
+            wstats = stats[line.worker_type] = dict(
+                lines=0, duration=0., operations={}, counts={}, phases={},
+                conflict_sources={}, timeslices=[])
+        # workers can be threads of the same process
+        workers.setdefault(line.worker_type, set()).add((line.pid,
+                                                         line.worker_id))
+        wstats['lines'] += 1
+        wstats['duration'] += line.duration or 0.
+        for section in ('operations', 'counts', 'phases',
+                        'conflict_sources'):
+            merge_sums(wstats[section], getattr(line, section))
+        if (line.timeslice is not None and
+                line.timeslice not in wstats['timeslices']):
+            wstats['timeslices'].append(line.timeslice)
+    for wtype, wstats in stats.items():
+        wstats['workers'] = len(workers[wtype])
+        wstats['timeslices'].sort()
+    return stats
+
+
+def fetch_new_lines(Metrics, seen, overlap):
+    """Return the Metrics lines that haven't been seen yet, ordered by id.
+
+    Lines get their ids and recording times before being committed, hence
+    they can become visible out of order. Therefore, the lines recorded
+    less than ``overlap`` seconds before the latest seen one are queried
+    again, and those that were already seen are filtered out.
+
+    :param dict seen: ids of the lines seen so far, mapped to their
+                      recording times. It is updated in place, and pruned
+                      of the lines that are too old to be queried again.
+    :param float overlap: in seconds, must exceed the time lines can stay
+                          uncommitted after being recorded.
+    """
+    query = Metrics.query().order_by(Metrics.id)
+    if seen:
+        cutoff = max(seen.values()) - timedelta(seconds=overlap)
+        query = query.filter(Metrics.dt_record >= cutoff)
+    lines = [line for line in query.all() if line.id not in seen]
+    seen.update((line.id, line.dt_record) for line in lines
+                if line.dt_record is not None)
+    if seen:
+        cutoff = max(seen.values()) - timedelta(seconds=overlap)
+        for line_id, dt_record in list(seen.items()):
+            if dt_record < cutoff:
+                del seen[line_id]
+    return lines
+
+
+def format_stats(stats, window=None):
+    """Render the result of :func:`aggregate` as human readable lines.
+
+    :param float window: if specified, wall time covered by ``stats``,
+                         used to display throughputs.
+    """
+    out = []
+    for wtype, wstats in sorted(stats.items()):
+        operations = sum(wstats['operations'].values())
+        head = "%s (%d workers)" % (wtype, wstats['workers'])
+        if wstats['timeslices']:
+            head += ", timeslices %s" % ', '.join(
+                str(t) for t in wstats['timeslices'])
+        if operations:
+            head += ", %d operations" % operations
+            if window:
+                head += " (%.1f ops/s)" % (operations / window)
+        out.append(head)
+        if wstats['operations']:
+            out.append("  operations: " + ', '.join(
+                "%s=%d" % (model.rsplit('.', 1)[-1], count)
+                for model, count in sorted(wstats['operations'].items())))
+        if wstats['counts']:
+            out.append("  counts: " + ', '.join(
+                "%s=%d" % item for item in sorted(wstats['counts'].items())))
+        if wstats['phases']:
+            out.append("  phases: " + ', '.join(
+                "%s=%.3fs" % item
+                for item in sorted(wstats['phases'].items())))
+        if wstats['conflict_sources']:
+            out.append("  conflicts: " + ', '.join(
+                "%s=%d" % item for item in sorted(
+                    wstats['conflict_sources'].items(),
+                    key=lambda item: -item[1])))
+    return '\n'.join(out)
+
+
+def run():
+    parser = ArgumentParser(
+        description="Aggregate the metrics recorded by workers, either "
+        "live or once for all",
+        formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--interval", type=float, default=5,
+                        help="Time in seconds between two live reports")
+    parser.add_argument("--once", action='store_true',
+                        help="Aggregate all recorded metrics, and exit")
+    parser.add_argument("--json", action='store_true',
+                        help="Output JSON instead of human readable lines")
+    parser.add_argument("--overlap", type=float, default=60,
+                        help="In live mode, time window in seconds in which "
+                        "lines are queried again, to catch those committed "
+                        "late")
+
+    logging.basicConfig(level=logging.WARNING)
+    arguments, anyblok_argv = parser.parse_known_args()
+    sys.argv[1:] = anyblok_argv
+
+    registry = anyblok.start('stats', configuration_groups=[],
+                             loadwithoutmigration=True)
+    if registry is None:
+        logging.critical("wms_example_stats: couldn't init registry")
+        sys.exit(1)
+
+    Metrics = registry.Wms.Worker.Metrics
+    seen = {}
+    if not arguments.once:
+        # live mode: only new lines matter
+        fetch_new_lines(Metrics, seen, arguments.overlap)
+        registry.rollback()
+
+    last_report = time.time()
+    while True:
+        if arguments.once:
+            lines = Metrics.query().order_by(Metrics.id).all()
+        else:
+            lines = fetch_new_lines(Metrics, seen, arguments.overlap)
+        stats = aggregate(lines)
+        # don't keep a long transaction open while sleeping
+        registry.rollback()
+        now = time.time()
+        window = None if arguments.once else now - last_report
+        last_report = now
+        if arguments.json:
+            print(json.dumps(dict(window=window, workers=stats),
+                             sort_keys=True))
+        elif stats:
+            print(format_stats(stats, window=window))
+        if arguments.once:
+            break
+        sys.stdout.flush()
+        try:
+            time.sleep(arguments.interval)
+        except KeyboardInterrupt:
+            break
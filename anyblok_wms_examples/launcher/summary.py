@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Examples project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""Gathering of per process results into a bench summary.
+
+Each worker, be it a process or a thread, puts a single dict in a shared
+queue right before exiting. Common keys are ``worker_type``, ``pid``,
+``worker_id``, ``conflicts`` and ``conflict_sources`` (conflicts by
+context and table). Regular
+workers add ``operations``, ``timeslice_durations`` and ``barrier_waits``
+(time spent waiting for other workers at the end of each timeslice),
+whereas continuous workers add ``processed`` and ``duration``.
+
+Workers also report ``startup_time`` and ``time_to_first_operation``,
+both counted from the launch of the whole run.
+"""
+import json
+import logging
+from queue import Empty
+
+logger = logging.getLogger(__name__)
+
+
+def collect_results(queue, processes, poll_interval=1, expected=None):
+    """Read results from worker processes, then join them.
+
+    The queue must be drained before joining, otherwise processes having
+    put big results would never terminate.
+
+    :param int expected: number of workers, if not equal to the number of
+                         processes (workers running as threads).
+    :return: list of result dicts. Workers that crashed don't
+             contribute any.
+    """
+    if expected is None:
+        expected = len(processes)
+    results = []
+    while len(results) < expected:
+        try:
+            results.append(queue.get(timeout=poll_interval))
+        except Empty:
+            if not any(p.is_alive() for p in processes):
+                # last chance for results put right before exiting
+                try:
+                    while True:
+                        results.append(queue.get_nowait())
+                except Empty:
+                    break
+    for process in processes:
+        process.join()
+        if process.exitcode != 0:
+            logger.error("Process %d exited with code %r",
+                         process.pid, process.exitcode)
+    return results
+
+
+def max_per_timeslice(results, key):
+    """Aggregate per timeslice lists of values by taking their maximum.
+
+    :param key: the key of the per timeslice lists in ``results``
+    :rtype: list
+    """
+    aggregated = []
+    for res in results:
+        for i, value in enumerate(res.get(key, ())):
+            if i == len(aggregated):
+                aggregated.append(value)
+            else:
+                aggregated[i] = max(aggregated[i], value)
+    return aggregated
+
+
+def summarize(arguments, wall_time, results, processes=()):
+    """Build the machine readable summary of a run.
+
+    :param arguments: the parsed command line arguments
+    :param float wall_time: total duration of the run, in seconds
+    :param results: as returned by :func:`collect_results`
+    :rtype: dict
+    """
+    operations = sum(r.get('operations', 0) for r in results)
+    conflicts = {}
+    conflict_sources = {}
+    processed = {}
+    for res in results:
+        wtype = res['worker_type']
+        conflicts[wtype] = conflicts.get(wtype, 0) + res['conflicts']
+        for source, count in res.get('conflict_sources', {}).items():
+            conflict_sources[source] = conflict_sources.get(source, 0) + count
+        if 'processed' in res:
+            processed[wtype] = processed.get(wtype, 0) + res['processed']
+            duration = res.get('duration')
+            res['processed_per_second'] = (res['processed'] / duration
+                                           if duration else 0.)
+
+    # by worker type, the slowest startup and the earliest first operation
+    startup = {}
+    first_operation = {}
+    for res in results:
+        wtype = res['worker_type']
+        if res.get('startup_time') is not None:
+            startup[wtype] = max(startup.get(wtype, 0), res['startup_time'])
+        if res.get('time_to_first_operation') is not None:
+            first_operation[wtype] = min(
+                first_operation.get(wtype, res['time_to_first_operation']),
+                res['time_to_first_operation'])
+
+    # a timeslice lasts until the slowest regular worker is done with it
+    timeslices = max_per_timeslice(results, 'timeslice_durations')
+
+    return dict(
+        arguments=vars(arguments),
+        wall_time=wall_time,
+        operations=operations,
+        ops_per_second=operations / wall_time if wall_time else 0.,
+        conflicts=conflicts,
+        conflict_sources=conflict_sources,
+        startup_time=startup,
+        time_to_first_operation=first_operation,
+        processed=processed,
+        timeslice_durations=timeslices,
+        barrier_waits=max_per_timeslice(results, 'barrier_waits'),
+        processes=len(processes),
+        exit_codes=[p.exitcode for p in processes],
+        workers=results,
+    )
+
+
+def output_summary(summary, path=None):
+    """Dump the summary as JSON, on stdout or in the given file."""
+    dumped = json.dumps(summary, indent=2, sort_keys=True)
+    if path is None:
+        print(dumped)
+        return
+    with open(path, 'w') as summary_file:
+        summary_file.write(dumped)
+        summary_file.write('\n')
+    logger.info("Bench summary written to %r", path)
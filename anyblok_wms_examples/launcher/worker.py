@@ -11,25 +11,409 @@ import sys
 import random
 import os
 import logging
-import select
+import re
+from datetime import datetime
 
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.exc import OperationalError
+from psycopg2.errorcodes import UNIQUE_VIOLATION
 from psycopg2.extensions import TransactionRollbackError
 
 from anyblok import Declarations
 from anyblok.column import Integer
 from anyblok.column import Boolean
+from anyblok.column import DateTime
+from anyblok.column import Float
+from anyblok.column import String
+from anyblok_postgres.column import Jsonb
+
+from .listener import poll_notifications
 
 logger = logging.getLogger(__name__)
 
 Model = Declarations.Model
 Mixin = Declarations.Mixin
 register = Declarations.register
+
+RESERVER_CHANNEL = 'wms_example_reserver'
+"""Notified when pending Reservation Requests may have become reservable."""
+
+PLANNER_CHANNEL = 'wms_example_planner'
+"""Notified when Reservation Requests have been reserved."""
+
+REGULAR_CHANNEL = 'wms_example_regular_workers'
+"""Notified when the set of active regular workers may have changed."""
+
+TIMESLICE_CHANNEL = 'wms_example_timeslice_finished'
+"""Notified by regular workers finishing a timeslice, with its number."""
+
+STATEMENT_TABLE_RE = re.compile(r'\b(?:FROM|UPDATE|INTO)\s+"?(\w+)',
+                                re.IGNORECASE)
 Wms = Model.Wms
 
 
 @register(Mixin)
-class WmsExamplesContinuousWorker:
+class WmsExamplesWorkerMetrics:
+    """A mixin for workers recording ``Wms.Worker.Metrics`` lines.
+
+    Metrics are accumulated in memory between two calls to
+    :meth:`record_metrics`. Conflicts are taken from the ``conflicts``
+    counter that concrete classes must have.
+    """
+
+    metrics = None
+    """Metrics accumulated since the latest call to :meth:`reset_metrics`.
+
+    This is a dict having the same keys as the JSON columns of
+    ``Wms.Worker.Metrics``: ``operations``, ``counts``, ``phases`` and
+    ``conflict_sources``.
+    """
+
+    first_work_time = None
+    """Time at which the first Operation or work item got done."""
+
+    def work_done(self):
+        """To be called whenever some Operation or work item got done."""
+        if self.first_work_time is None:
+            self.first_work_time = time.time()
+
+    def reset_metrics(self):
+        self.metrics = dict(operations={}, counts={}, phases={},
+                            conflict_sources={})
+        self.metrics_start = time.time()
+        self.metrics_conflicts = self.conflicts
+
+    def add_metric(self, section, key, value):
+        if self.metrics is None:
+            self.reset_metrics()
+        values = self.metrics[section]
+        values[key] = values.get(key, 0) + value
+
+    def count_metric(self, key, count=1):
+        """Increment the given counter, e.g., ``purchases``."""
+        self.add_metric('counts', key, count)
+
+    def count_operation(self, model):
+        """Count an executed Operation.
+
+        :param str model: registry name of the Operation model
+        """
+        self.add_metric('operations', model, 1)
+        self.work_done()
+
+    def add_phase_time(self, phase, elapsed):
+        """Add time spent in the given phase, in seconds."""
+        self.add_metric('phases', phase, elapsed)
+
+    def record_metrics(self, timeslice=None):
+        """Insert a Metrics line with the accumulated values and reset them.
+
+        This doesn't commit.
+        """
+        if self.metrics is None:
+            self.reset_metrics()
+        self.count_metric('conflicts',
+                          self.conflicts - self.metrics_conflicts)
+        metrics = self.metrics
+        line = self.registry.Wms.Worker.Metrics.insert(
+            worker_type=self.__registry_name__.rsplit('.', 1)[-1],
+            pid=self.pid,
+            worker_id=self.id,
+            timeslice=timeslice,
+            duration=time.time() - self.metrics_start,
+            operations=metrics['operations'],
+            counts=metrics['counts'],
+            phases=metrics['phases'],
+            conflict_sources=metrics['conflict_sources'])
+        self.reset_metrics()
+        return line
+
+
+@register(Mixin)
+class WmsExamplesConflictRetry(Mixin.WmsExamplesWorkerMetrics):
+    """A mixin for workers retrying transactions after database conflicts.
+
+    Conflicts are serialization failures and deadlocks, i.e., errors that
+    should not happen again if the transaction is simply retried. Retrying
+    right away tends to produce storms of conflicts on the same rows,
+    hence workers back off exponentially after consecutive conflicts, with
+    full jitter so that competing workers don't retry in lockstep.
+
+    Conflicts are also tracked by source, i.e., what was being done and
+    the table involved, so that hot spots can be identified.
+    """
+
+    conflicts = 0
+    """Total number of conflicts."""
+
+    conflict_streak = 0
+    """Number of consecutive conflicts."""
+
+    conflict_sources = None
+    """Number of conflicts, by source (see :meth:`handle_conflict`)."""
+
+    failure_streak = 0
+    """Number of consecutive failed attempts, conflicts or not."""
+
+    retry_base_delay = 0.005
+    """Maximal time to back off after a first conflict, in seconds."""
+
+    retry_max_delay = 0.5
+    """Maximal time to back off, whatever the number of conflicts."""
+
+    retry_max_attempts = 5
+    """Maximal number of attempts in :meth:`with_retries`.
+
+    This is also the number of consecutive failures after which
+    :meth:`handle_failure` tells to give up.
+    """
+
+    @staticmethod
+    def is_conflict(exc):
+        """Tell whether the given database exception is a conflict."""
+        return isinstance(getattr(exc, 'orig', None),
+                          TransactionRollbackError)
+
+    @staticmethod
+    def conflict_table(exc):
+        """Find the table involved in a conflict, as precisely as possible.
+
+        PostgreSQL doesn't always provide it in diagnostics, in which case
+        we fall back to the first table of the failed statement.
+        """
+        diag = getattr(getattr(exc, 'orig', None), 'diag', None)
+        table = getattr(diag, 'table_name', None)
+        if table:
+            return table
+        match = STATEMENT_TABLE_RE.search(getattr(exc, 'statement', None) or
+                                          '')
+        return match.group(1) if match is not None else 'unknown'
+
+    def backoff_delay(self, streak=None):
+        """Random time to wait, according to :attr:`conflict_streak`.
+
+        :param int streak: if specified, used instead of
+                           :attr:`conflict_streak`
+        """
+        if streak is None:
+            streak = self.conflict_streak
+        delay = min(self.retry_max_delay,
+                    self.retry_base_delay * 2 ** (streak - 1))
+        return random.uniform(0, delay)
+
+    def handle_conflict(self, exc, self_str, context, rollback=True):
+        """Account for a conflict, roll back, then back off.
+
+        :param str context: what was being done, e.g., ``execution``. The
+                            source of the conflict is made of it and the
+                            table involved.
+        :param bool rollback: if ``False``, the transaction is considered
+                              to be already rolled back.
+        :return: time spent backing off, in seconds
+        """
+        if rollback:
+            self.registry.rollback()
+        self.conflicts += 1
+        self.conflict_streak += 1
+        source = '%s/%s' % (context, self.conflict_table(exc))
+        if self.conflict_sources is None:
+            self.conflict_sources = {}
+        self.conflict_sources[source] = self.conflict_sources.get(
+            source, 0) + 1
+        self.add_metric('conflict_sources', source, 1)
+        delay = self.backoff_delay()
+        logger.warning("%s, got conflict (%s, %d in a row), backing off "
+                       "for %.3f seconds: %s",
+                       self_str, source, self.conflict_streak, delay, exc)
+        time.sleep(delay)
+        return delay
+
+    def conflict_resolved(self):
+        """To be called after each successful transaction."""
+        self.conflict_streak = 0
+        self.failure_streak = 0
+
+    def handle_failure(self, exc, self_str, context):
+        """Account for a failed transaction, and tell whether to try again.
+
+        Conflicts are handled by :meth:`handle_conflict`. Other exceptions
+        are logged and rolled back, then backed off from in the same way,
+        so that a persistent error can't make the worker spin.
+
+        This must be called from the ``except`` clause.
+
+        :param str context: see :meth:`handle_conflict`
+        :return: ``False`` once :attr:`retry_max_attempts` consecutive
+                 attempts have failed.
+        """
+        self.failure_streak += 1
+        if self.is_conflict(exc):
+            self.handle_conflict(exc, self_str, context)
+        else:
+            self.registry.rollback()
+            logger.exception("%s, exception in %s", self_str, context)
+            time.sleep(self.backoff_delay(streak=self.failure_streak))
+        if self.failure_streak < self.retry_max_attempts:
+            return True
+        logger.warning("%s, giving up %s after %d failed attempts",
+                       self_str, context, self.failure_streak)
+        self.failure_streak = 0
+        return False
+
+    def with_retries(self, func, self_str, context, gave_up=None):
+        """Call ``func`` and commit, retrying with backoff upon conflicts.
+
+        Exceptions other than conflicts are not caught.
+
+        :param str context: see :meth:`handle_conflict`
+        :param gave_up: returned if all :attr:`retry_max_attempts` attempts
+                        conflicted.
+        :return: the result of ``func``, or ``gave_up``
+        """
+        for attempt in range(self.retry_max_attempts):
+            try:
+                result = func()
+                self.registry.commit()
+            except OperationalError as exc:
+                if not self.is_conflict(exc):
+                    raise
+                self.handle_conflict(exc, self_str, context)
+            else:
+                self.conflict_resolved()
+                return result
+        logger.warning("%s, giving up %s after %d conflicting attempts",
+                       self_str, context, self.retry_max_attempts)
+        return gave_up
+
+
+@register(Mixin)
+class WmsExamplesNotificationsListener:
+    """A mixin for workers receiving PostgreSQL notifications.
+    """
+
+    listener = None
+    """Dedicated listening connection.
+
+    This is a :class:`anyblok_wms_examples.launcher.listener.Listener`
+    instance, that must be used if workers access the database through a
+    transaction pooler, or run as threads sharing a connection pool.
+    If ``None``, notifications are received on the connection of the
+    session.
+    """
+
+    listening = False
+    """Set to ``True`` by :meth:`subscribe`."""
+
+    waiting_notifications = False
+    """``True`` while waiting on the connection of the session.
+
+    Session listeners must not issue any query at transaction begin
+    meanwhile, see :meth:`receive_notifications`.
+    """
+
+    def subscribe(self, *channels):
+        """Subscribe to the given notification channels.
+
+        Without :attr:`listener`, this commits, as ``LISTEN`` takes effect
+        at commit time.
+        """
+        if self.listener is not None:
+            self.listener.listen(*channels)
+        else:
+            for channel in channels:
+                self.registry.execute("LISTEN %s" % channel)
+            self.registry.commit()
+        self.listening = True
+
+    def receive_notifications(self, timeout):
+        """Wait for notifications, for at most ``timeout`` seconds.
+
+        Without :attr:`listener`, notifications are not delivered within
+        a transaction. Therefore this commits before and after waiting, and
+        the connection of the session is acquired with
+        :attr:`waiting_notifications` set, so that no transaction gets
+        started on it.
+
+        :return: list of received notifications
+        """
+        if self.listener is not None:
+            return self.listener.wait(timeout)
+        registry = self.registry
+        registry.commit()
+        self.waiting_notifications = True
+        try:
+            return poll_notifications(registry.session.connection().connection,
+                                      timeout)
+        finally:
+            self.waiting_notifications = False
+            registry.commit()
+
+
+@register(Mixin)
+class WmsExamplesPhaseIsolation:
+    """A mixin for workers using different isolation levels in their phases.
+
+    This works with a session listener that sets the isolation level of
+    each transaction before any query. Only the transactions of the
+    worker's session are affected, so that several workers can run as
+    threads of the same process.
+    """
+
+    phase_isolation = None
+    """Isolation levels for the transactions of each phase, if not default.
+
+    See :meth:`install_phase_isolation`.
+    """
+
+    current_phase = None
+    """The phase subsequent transactions belong to. See :meth:`enter_phase`.
+    """
+
+    def install_phase_isolation(self, phase_isolation):
+        """Use specific isolation levels for the given phases.
+
+        Transactions of other phases keep the isolation level of the
+        engine. The ``None`` phase stands for transactions outside of any
+        explicitly declared phase.
+
+        :param dict phase_isolation: phase names to isolation levels,
+                                     e.g, ``{'sales': 'READ COMMITTED'}``
+        """
+        self.phase_isolation = dict(phase_isolation)
+        event.listen(self.registry.session, 'after_begin',
+                     self.apply_phase_isolation)
+
+    def apply_phase_isolation(self, session, transaction, connection):
+        """Session listener setting the isolation level of new transactions.
+
+        This happens before any query, as PostgreSQL requires. Nothing is
+        done while waiting for notifications, as that would start a
+        transaction, delaying their delivery until the wait times out.
+        """
+        if session is not self.registry.session:
+            # belongs to another worker thread
+            return
+        if getattr(self, 'waiting_notifications', False):
+            return
+        level = self.phase_isolation.get(self.current_phase)
+        if level is not None:
+            connection.execute("SET TRANSACTION ISOLATION LEVEL " + level)
+
+    def enter_phase(self, phase):
+        """Declare that subsequent transactions belong to ``phase``.
+
+        This commits, so that the next transaction gets the isolation
+        level of the phase.
+        """
+        self.registry.commit()
+        self.current_phase = phase
+
+
+@register(Mixin)
+class WmsExamplesContinuousWorker(Mixin.WmsExamplesConflictRetry,
+                                  Mixin.WmsExamplesNotificationsListener,
+                                  Mixin.WmsExamplesPhaseIsolation):
     """A mixin for workers that always run in the background.
 
     We could also not represent them in the database, but it's convenient
@@ -39,7 +423,13 @@ class WmsExamplesContinuousWorker:
     periodically check if regular workers are finished, meaning that
     the bench or test run is done.
     """
-    pid = Integer(primary_key=True)
+    id = Integer(label="Identifier", primary_key=True)
+    pid = Integer(label="Process id")
+    batch_size = Integer(default=1)
+    """Number of work items to take care of in a single transaction.
+
+    Concrete classes may ignore it.
+    """
     sleep_interval = 0.01
     """Time to sleep if there's nothing to be done."""
     inactivity_count = 0
@@ -47,31 +437,110 @@ class WmsExamplesContinuousWorker:
     max_sleep = 1
     """Maximal time to sleep."""
 
+    listen_channel = None
+    """Notification channel announcing new work for this worker type.
+
+    See :meth:`listen` and ``Wms.Worker.install_triggers()``.
+    """
+    max_wait = 5
+    """Maximal time to wait for notifications.
+
+    This is a safety net, in case some work appears without any
+    notification being emitted.
+    """
+
+    metrics_interval = 10
+    """Time in seconds between two recordings of metrics."""
+
+    active_check_interval = 10
+    """Maximal age in seconds of the cached count of active regular workers.
+    """
+    _active_count = None
+    _active_checked = None
+
     conflicts = 0
 
+    processed = 0
+    """Number of work items processed.
+
+    This is the sum of :meth:`process_one` return values, where ``True``
+    counts for one.
+    """
+
     def __repr__(self):
-        return "%s(pid=%d)" % (self.__registry_name__, self.pid)
+        # in tests, id and pid can be None, hence let's avoid %d
+        return "%s(id=%s, pid=%s)" % (self.__registry_name__,
+                                      self.id, self.pid)
 
     @classmethod
-    def should_proceed(cls):
-        """Return ``False`` iff all regular workers are finished."""
-        Regular = cls.registry.Wms.Worker.Regular
-        count = Regular.query().filter(Regular.active.is_(True)).count()
-        # if another locking txn commits after this first request that
-        # inits the mvcc but before our attempts to lock, we'll get a
-        # serialization error, because the other txn has released its locks.
-        cls.registry.commit()
+    def should_proceed(cls, refresh=False):
+        """Return ``False`` iff all regular workers are finished.
+
+        The count of active regular workers is cached, for at most
+        :attr:`active_check_interval` seconds. The cache is also cleared
+        whenever a notification about regular workers is received.
+
+        :param bool refresh: if ``True``, ignore the cached value.
+        """
+        now = time.time()
+        if (refresh or cls._active_count is None or
+                now - cls._active_checked > cls.active_check_interval):
+            Regular = cls.registry.Wms.Worker.Regular
+            count = Regular.query().filter(Regular.active.is_(True)).count()
+            # if another locking txn commits after this first request that
+            # inits the mvcc but before our attempts to lock, we'll get a
+            # serialization error, because the other txn has released its
+            # locks.
+            cls.registry.commit()
+            cls._active_count, cls._active_checked = count, now
+        count = cls._active_count
         if count:
             logger.debug("%s: There are still %d active regular workers. "
                          "Proceeding further", cls.__registry_name__, count)
             return True
         return False
 
+    def listen(self):
+        """Subscribe to the notifications relevant to this worker.
+
+        From then on, :meth:`maybe_sleep` waits for notifications instead
+        of sleeping.
+        """
+        self.subscribe(*(channel
+                         for channel in (self.listen_channel, REGULAR_CHANNEL)
+                         if channel is not None))
+
+    def wait_notification(self, timeout):
+        """Block until a notification is received, or timeout expires.
+
+        All pending notifications are consumed. Those about regular workers
+        clear the cached count used by :meth:`should_proceed`.
+
+        :return: number of notifications received
+        """
+        notifies = self.receive_notifications(timeout)
+        for notify in notifies:
+            if notify.channel == REGULAR_CHANNEL:
+                self.__class__._active_count = None
+        return len(notifies)
+
     def maybe_sleep(self, prefix, something_done):
-        """If nothing has been done, sleep for a while."""
+        """If nothing has been done, sleep for a while.
+
+        If :meth:`listen` has been called, this waits for a notification
+        instead, for at most :attr:`max_wait` seconds.
+        """
         logger.debug("%s: maybe_sleep", prefix)
         if something_done:
             self.inactivity_count = 0
+        elif self.listening:
+            self.inactivity_count += 1
+            # don't keep a transaction open while waiting
+            self.registry.commit()
+            logger.info("%s: nothing to be done at the moment; "
+                        "waiting for notifications", prefix)
+            received = self.wait_notification(self.max_wait)
+            logger.info("%s: waking up (%d notifications)", prefix, received)
         else:
             self.inactivity_count += 1
             sleep = min(self.sleep_interval * self.inactivity_count,
@@ -85,46 +554,145 @@ class WmsExamplesContinuousWorker:
 
     def run(self):
         self_str = str(self)  # can't be done after an error
+        self.reset_metrics()
         while self.should_proceed():
+            start = time.time()
+            conflicts = self.conflicts
             try:
-                # TODO make a bunch instead ?
                 something_done = self.process_one(self_str=self_str)
                 self.registry.commit()
+                if self.conflicts == conflicts:
+                    # conflicts handled within process_one() must keep
+                    # backing off
+                    self.conflict_resolved()
+                if something_done:
+                    # booleans count for one
+                    self.processed += something_done
+                    self.count_metric('processed', int(something_done))
+                    self.work_done()
             except KeyboardInterrupt:
                 self.registry.rollback()
                 logger.warning("%s: got keyboard interrupt, quitting",
                                self_str)
                 return
             except OperationalError as exc:
-                if isinstance(exc.orig, TransactionRollbackError):
-                    self.conflicts += 1
-                    logger.warning("%s: got conflict: %s", self_str, exc)
+                if self.is_conflict(exc):
+                    self.handle_conflict(exc, self_str, 'process')
                 else:
                     logger.exception("%s: catched exception in main loop",
                                      self_str)
-                self.registry.rollback()
+                    self.registry.rollback()
             except:
                 logger.exception("%s: got exception in main loop", self_str)
                 self.registry.rollback()
             else:
+                self.add_phase_time('working', time.time() - start)
+                start = time.time()
                 try:
                     self.maybe_sleep(self_str, something_done)
                 except KeyboardInterrupt:
                     logger.warning("%s: got keyboard interrupt, quitting",
                                    self_str)
                     return
+                self.add_phase_time('waiting', time.time() - start)
+                if time.time() - self.metrics_start > self.metrics_interval:
+                    self.record_metrics()
+                    self.registry.commit()
+        self.record_metrics()
+        self.registry.commit()
         logger.info("%s: No more active regular worker. Stopping there. "
-                    "Total number of conflicts: %d",
-                    self_str, self.conflicts)
+                    "Total number of conflicts: %d, work items processed: %d",
+                    self_str, self.conflicts, self.processed)
 
 
 @register(Wms)
 class Worker:
-    """Just a namespace."""
+    """Namespace for workers.
+
+    It also exposes the notification channels for other bloks. Notifications
+    are emitted by database triggers (see :meth:`install_triggers`), hence
+    whatever the code path creating the work.
+    """
+
+    RESERVER_CHANNEL = RESERVER_CHANNEL
+    PLANNER_CHANNEL = PLANNER_CHANNEL
+    REGULAR_CHANNEL = REGULAR_CHANNEL
+    TIMESLICE_CHANNEL = TIMESLICE_CHANNEL
+
+    @classmethod
+    def install_triggers(cls):
+        """Create (or replace) the triggers emitting notifications.
+
+        This needs the Reservation tables, and therefore has to be called
+        by the installation of some blok requiring ``wms-reservation``.
+
+        PostgreSQL collapses identical notifications within a transaction,
+        so that row level triggers are not a problem for batches.
+        """
+        cls.registry.execute("""
+        CREATE OR REPLACE FUNCTION wms_example_notify() RETURNS trigger AS $$
+        BEGIN
+          PERFORM pg_notify(TG_ARGV[0], '');
+          RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS wms_example_notify_request_created
+          ON wms_reservation_request;
+        CREATE TRIGGER wms_example_notify_request_created
+          AFTER INSERT ON wms_reservation_request
+          FOR EACH STATEMENT
+          EXECUTE PROCEDURE wms_example_notify('{reserver}');
+
+        DROP TRIGGER IF EXISTS wms_example_notify_request_inserted_reserved
+          ON wms_reservation_request;
+        CREATE TRIGGER wms_example_notify_request_inserted_reserved
+          AFTER INSERT ON wms_reservation_request
+          FOR EACH ROW WHEN (NEW.reserved AND NOT NEW.planned)
+          EXECUTE PROCEDURE wms_example_notify('{planner}');
+
+        DROP TRIGGER IF EXISTS wms_example_notify_request_reserved
+          ON wms_reservation_request;
+        CREATE TRIGGER wms_example_notify_request_reserved
+          AFTER UPDATE OF reserved ON wms_reservation_request
+          FOR EACH ROW WHEN (NEW.reserved AND NOT OLD.reserved)
+          EXECUTE PROCEDURE wms_example_notify('{planner}');
+
+        DROP TRIGGER IF EXISTS wms_example_notify_regular
+          ON wms_worker_regular;
+        CREATE TRIGGER wms_example_notify_regular
+          AFTER INSERT OR DELETE OR UPDATE OF active ON wms_worker_regular
+          FOR EACH STATEMENT
+          EXECUTE PROCEDURE wms_example_notify('{regular}');
+        """.format(reserver=RESERVER_CHANNEL,
+                   planner=PLANNER_CHANNEL,
+                   regular=REGULAR_CHANNEL))
+
+
+@register(Wms.Worker)
+class Metrics:
+    """Statistics recorded by workers, for live and post mortem analysis.
+
+    Regular workers record one line per timeslice, whereas continuous
+    workers record one periodically and a last one when stopping.
+    """
+    id = Integer(label="Identifier", primary_key=True)
+    worker_type = String(label="Worker type, e.g, Regular",
+                         nullable=False, index=True)
+    pid = Integer(label="Worker process id")
+    worker_id = Integer(label="Worker record id, among those of its type")
+    timeslice = Integer(label="Timeslice (regular workers only)")
+    dt_record = DateTime(label="Recording time", default=datetime.now)
+    duration = Float(label="Time covered by this line, in seconds")
+    operations = Jsonb(label="Number of executed Operations, by model")
+    counts = Jsonb(label="Counters, e.g., purchases, conflicts, retries")
+    phases = Jsonb(label="Time spent in each phase, in seconds")
+    conflict_sources = Jsonb(label="Number of conflicts, by context/table")
 
 
 @register(Wms.Worker)
 class Planner(Mixin.WmsExamplesContinuousWorker):
+    listen_channel = PLANNER_CHANNEL
 
     def process_one(self):
         """Select a full reservation and plan it.
@@ -135,18 +703,102 @@ class Planner(Mixin.WmsExamplesContinuousWorker):
 
 @register(Wms.Worker)
 class Reserver(Mixin.WmsExamplesContinuousWorker):
+    """Reservers work on the pending Requests whose id is in their partition.
+
+    Partitioning is what makes it possible to run several Reservers
+    concurrently: otherwise they would compete for the same locks.
+    Reservers of different partitions can still try and reserve the same
+    PhysObj, which is caught by the primary key of Reservations. This is
+    handled as a conflict, see :meth:`is_reservation_clash`.
+    """
+    listen_channel = RESERVER_CHANNEL
+
+    partition = Integer(default=0)
+    """Ids of the Requests to take care of are equal to this modulo
+    :attr:`partitions`"""
+
+    partitions = Integer(default=1)
+    """Total number of partitions, usually the number of Reservers."""
+
+    def partition_filter(self):
+        """Return a function to restrict Requests to our partition.
+
+        This is meant for the ``query_filter`` parameter of
+        ``Request.lock_unreserved()``.
+        """
+        partitions = self.partitions
+        if partitions is None or partitions < 2:
+            return None
+        Request = self.registry.Wms.Reservation.Request
+        partition = self.partition
+
+        def query_filter(query):
+            return query.filter(Request.id % partitions == partition)
+
+        return query_filter
+
+    @classmethod
+    def is_reservation_clash(cls, exc):
+        """Tell if an integrity error is due to a concurrent reservation.
+
+        This is a unique violation on the Reservation table, whose primary
+        key is the reserved PhysObj.
+        """
+        return (getattr(exc.orig, 'pgcode', None) == UNIQUE_VIOLATION and
+                cls.conflict_table(exc) ==
+                cls.registry.Wms.Reservation.__table__.name)
 
     def process_one(self, self_str=None):
-        """Try and perform a reservation.
+        """Try and perform reservations for all pending Requests.
+
+        This is similar to ``Request.reserve_all()``, restricted to
+        our partition, and keeping statistics.
+
+        Conflicts end the processing, after backing off, and so do clashes
+        with the reservations of other Reservers. Only the Requests
+        reserved by previous batches are kept.
 
-        To be refined in concrete subclasses
+        :return: number of Requests that got fully reserved
         """
-        # TODO this commits, hence the outer loop's commit is redundant
-        self.registry.Wms.Reservation.Request.reserve_all(batch_size=1)
+        Request = self.registry.Wms.Reservation.Request
+        query_filter = self.partition_filter()
+        batch_size = self.batch_size or 1
+        reserved = skip = 0
+        while True:
+            try:
+                requests = Request.lock_unreserved(batch_size,
+                                                   offset=skip,
+                                                   query_filter=query_filter)
+            except Request.ReservationsLocked as exc:
+                # lock_unreserved() has already rolled back
+                self.handle_conflict(exc.db_exc, self_str, 'lock_unreserved',
+                                     rollback=False)
+                break
+            if not requests:
+                break
+            batch_reserved = batch_skip = 0
+            try:
+                for request in requests:
+                    if request.reserve():
+                        batch_reserved += 1
+                    else:
+                        batch_skip += 1
+                # this commits, hence the outer loop's commit is redundant
+                self.registry.commit()
+            except IntegrityError as exc:
+                if not self.is_reservation_clash(exc):
+                    raise
+                self.handle_conflict(exc, self_str, 'reserve')
+                break
+            reserved += batch_reserved
+            skip += batch_skip
+        return reserved
 
 
 @register(Wms.Worker)
-class Regular:
+class Regular(Mixin.WmsExamplesConflictRetry,
+              Mixin.WmsExamplesNotificationsListener,
+              Mixin.WmsExamplesPhaseIsolation):
     """A regular worker, processing time slices.
 
     A time slice is the batch operation equivalent of a day's work,
@@ -160,24 +812,166 @@ class Regular:
     max_timeslice = Integer(label="Greatest timeslice to run")
     active = Boolean()
     sales_per_timeslice = Integer(default=10)
+    batch_size = Integer(default=1)
+    """Maximum number of Operations to execute in a single transaction."""
 
     other = set()
 
     simulate_sleep = 10
 
+    workload = None
+    """Random generator of the simulated workload.
+
+    This is an :class:`anyblok_wms_examples.workload.Workload` instance,
+    typically seeded by the launcher, so that runs are reproducible.
+    """
+
+    feed_stream = None
+    """If not ``None``, the workload is pulled from the staging table.
+
+    The value is the stream number of the worker in the loaded feed,
+    see :mod:`anyblok_wms_examples.workload`.
+    """
+
+    feed_offset = 0
+    """Last timeslice done before the run started.
+
+    Subtracting it from :attr:`current_timeslice` gives the timeslice
+    number relative to the feed.
+    """
+
     conflicts = 0
     """Used to report number of database conflicts."""
 
+    spins = 0
+    """Number of times no Operation could be executed, although some remain.
+
+    This happens when the ready Operations are all locked by other workers.
+    """
+
+    spin_streak = 0
+    """Number of consecutive spins, see :meth:`spin`."""
+
+    pending_batch = ()
+    """Ids of the Operations locked by the current transaction.
+
+    They are retried one by one if the transaction fails, see
+    :meth:`retry_pending_batch`.
+    """
+
+    given_up_operations = frozenset()
+    """Ids of the Operations given up for the current timeslice.
+
+    Concrete subclasses must not select them any more. See
+    :meth:`retry_pending_batch`.
+    """
+
     def process_one(self):
         """To be implemented by concrete subclasses.
 
         The default implementation is a stub that simply sleeps for a while.
         """
-        time.sleep(random.randrange(self.simulate_sleep)/100.0)
+        rng = random if self.workload is None else self.workload
+        time.sleep(rng.randrange(self.simulate_sleep)/100.0)
         return False
 
+    def process_batch(self):
+        """Execute up to :attr:`batch_size` Operations in one transaction.
+
+        Concrete subclasses should lock all of them with a single query, and
+        store their ids in :attr:`pending_batch`, so that they can be
+        retried individually in case the batch transaction fails.
+
+        The default implementation simply wraps :meth:`process_one`.
+
+        :return: same as :meth:`process_one`, except that executed
+                 Operations are described by a list of ``(model, id)`` pairs.
+        """
+        op = self.process_one()
+        if op is None or op is True:
+            return op
+        return [op]
+
+    def execute_operation(self, op_id):
+        """Execute the given Operation, if still possible.
+
+        This is used to retry Operations from a failed batch. Concrete
+        subclasses must lock the Operation, and check that it is still
+        ready to be executed.
+
+        :return: ``(model, id)`` pair or ``None`` if nothing was done.
+        """
+
+    def retry_pending_batch(self, self_str, execute=None):
+        """Retry the Operations of a failed transaction, one per transaction.
+
+        Each of them is given up for the current timeslice if it fails
+        with an exception, or conflicts :attr:`retry_max_attempts` times.
+        This way, failures of given Operations can't stall the whole
+        timeslice, nor shorten it.
+
+        :param execute: function to execute an Operation, given its id.
+                        Defaults to :meth:`execute_operation`.
+        :return: ``(model, id)`` pairs of the Operations that got executed.
+        """
+        if execute is None:
+            execute = self.execute_operation
+        pending, self.pending_batch = self.pending_batch, ()
+        executed = []
+        for op_id in pending:
+            self.count_metric('retries')
+            try:
+                op = self.with_retries(lambda: execute(op_id), self_str,
+                                       'retry', gave_up=False)
+            except KeyboardInterrupt:
+                raise
+            except Exception:
+                self.registry.rollback()
+                logger.exception("%s, exception in %s(%d)",
+                                 self_str, execute.__name__, op_id)
+                op = False
+            if op is False:
+                self.give_up_operation(op_id, self_str)
+            elif op is not None:
+                executed.append(op)
+                logger.info("%s, %s(id=%d) done and committed (retry)",
+                            self_str, op[0], op[1])
+        return executed
+
+    def give_up_operation(self, op_id, self_str):
+        """Don't try and execute the given Operation in this timeslice."""
+        logger.error("%s, giving up Operation %d for timeslice %d",
+                     self_str, op_id, self.current_timeslice)
+        self.given_up_operations = self.given_up_operations | {op_id}
+        self.count_metric('given_up')
+
+    def handle_pending_failure(self, exc, self_str, context, execute=None):
+        """Handle the failure of a transaction, then retry its Operations.
+
+        Conflicts are handled by :meth:`handle_conflict`. Other exceptions
+        are attributed to the Operations of :attr:`pending_batch`, retried
+        and maybe given up by :meth:`retry_pending_batch`. If there are
+        none, :meth:`handle_failure` tells whether to go on.
+
+        :param execute: see :meth:`retry_pending_batch`
+        :return: ``(proceed, executed)``, where ``executed`` is as
+                 returned by :meth:`retry_pending_batch`.
+        """
+        proceed = True
+        if self.is_conflict(exc):
+            self.handle_conflict(exc, self_str, context)
+        elif self.pending_batch:
+            self.registry.rollback()
+            logger.exception("%s, exception in %s", self_str, context)
+        else:
+            proceed = self.handle_failure(exc, self_str, context)
+        return proceed, self.retry_pending_batch(self_str, execute=execute)
+
     def begin_timeslice(self):
         """Do all business logic that has to be done at the timeslice start.
+
+        Concrete subclasses should call :meth:`enter_phase` to declare
+        their different phases, such as arrivals or sales.
         """
 
     @property
@@ -198,70 +992,135 @@ class Regular:
         return
 
     def run_timeslice(self):
+        """Run a whole timeslice.
+
+        :return: the number of executed Operations
+        """
         tsl = self.current_timeslice
         self_str = str(self)
         logger.info("%s, starting timeslice %d", self_str, tsl)
+        self.reset_metrics()
+        self.given_up_operations = frozenset()
+        start = time.time()
         self.begin_timeslice()
+        self.add_phase_time('begin', time.time() - start)
         logger.info("%s, begin sequence for timeslice %d finished, now "
                     "proceeding to normal work", self, tsl)
         # it's important to start with a fresh MVCC snapshot
         # no matter what (especially requests due to logging)
-        self.registry.commit()
+        self.enter_phase('execution')
+        batch = self.batch_size is not None and self.batch_size > 1
+        executed = 0
+        start = time.time()
         proceed = True
         while proceed:
             try:
-                op = self.process_one()
+                if batch:
+                    ops = self.process_batch()
+                else:
+                    ops = self.process_one()
+                    if ops is not None and ops is not True:
+                        ops = [ops]
                 self.registry.commit()
-                if op is None:
+                self.conflict_resolved()
+                self.pending_batch = ()
+                if ops is None:
                     proceed = False
-                elif op is not True:
-                    logger.info("%s, %s(id=%d) done and committed",
-                                self_str, op[0], op[1])
+                elif ops is True:
+                    self.spin(self_str)
+                else:
+                    self.spin_streak = 0
+                    executed += len(ops)
+                    for op in ops:
+                        self.count_operation(op[0])
+                        logger.info("%s, %s(id=%d) done and committed",
+                                    self_str, op[0], op[1])
             except KeyboardInterrupt:
                 raise
-            except OperationalError as exc:
-                if isinstance(exc.orig, TransactionRollbackError):
-                    self.conflicts += 1
-                    logger.warning("%s, got conflict: %s", self_str, exc)
-                else:
-                    logger.exception("%s, catched exception in main loop",
-                                     self_str)
-                self.registry.rollback()
-            except:
-                self.registry.rollback()
-                logger.exception("%s, exception in process_one()", self_str)
+            except Exception as exc:
+                proceed, retried = self.handle_pending_failure(
+                    exc, self_str, 'execution')
+                executed += len(retried)
+                for op in retried:
+                    self.count_operation(op[0])
+        elapsed = time.time() - start
+        self.add_phase_time('execution', elapsed)
+        self.enter_phase(None)
+        self.record_metrics(timeslice=tsl)
 
         self.done_timeslice = tsl
         if tsl == self.max_timeslice:
             self.active = False
+        # sent at commit time, i.e., once done_timeslice is visible
+        self.registry.execute("NOTIFY %s, '%d'" % (TIMESLICE_CHANNEL, tsl))
         self.registry.commit()
         logger.info("%s, finished timeslice %d. "
-                    "Cumulated number of conflicts: %d", self_str, tsl,
-                    self.conflicts)
+                    "Cumulated number of conflicts: %d, of spins: %d",
+                    self_str, tsl, self.conflicts, self.spins)
+        logger.info("%s, timeslice %d throughput: %d operations "
+                    "in %.3f seconds (%.1f ops/s, batch size %d)",
+                    self_str, tsl, executed, elapsed,
+                    executed / elapsed if elapsed else 0.,
+                    self.batch_size if batch else 1)
         sys.stderr.flush()
-        self.registry.session.execute("NOTIFY timeslice_finished, '%d'" % tsl)
-        self.registry.commit()
+        return executed
+
+    def spin(self, self_str):
+        """Back off while the ready Operations are locked by other workers.
+
+        The delay grows with :attr:`spin_streak`, as for conflicts (see
+        :meth:`backoff_delay`), the other workers being likely to need
+        more time if they haven't committed yet.
+
+        :return: time spent backing off, in seconds
+        """
+        self.spins += 1
+        self.spin_streak += 1
+        self.count_metric('spins')
+        delay = self.backoff_delay(streak=self.spin_streak)
+        self.add_phase_time('spinning', delay)
+        logger.debug("%s, ready Operations are locked by others, "
+                     "backing off for %.3f seconds", self_str, delay)
+        time.sleep(delay)
+        return delay
+
+    def listen_timeslices(self):
+        """Subscribe to the notifications the timeslice barrier relies on.
+
+        Besides the end of timeslices, changes in the set of active workers
+        matter, e.g., if one of them gets interrupted.
+        """
+        if not self.listening:
+            self.subscribe(TIMESLICE_CHANNEL, REGULAR_CHANNEL)
 
     def wait_others(self, timeslice):
-        self.registry.session.execute("LISTEN timeline_finished")
-        while 1:
+        """Wait until all active regular workers are done with ``timeslice``.
+
+        This is a barrier: subscription happens before checking, so that
+        the last worker to finish can't be missed, and no time is lost
+        waiting if we are that last worker ourselves.
+
+        :param int timeslice: absolute timeslice number, as in
+                              :attr:`done_timeslice`, i.e., counting those
+                              of previous runs on the same database.
+        :return: time spent waiting, in seconds
+        """
+        start = time.time()
+        self.listen_timeslices()
+        while not self.all_finished(timeslice):
+            # all_finished() needs a fresh MVCC snapshot after each wake up
             self.registry.commit()
-            conn = self.registry.session.connection().connection
-            if select.select([conn], [], [], self.simulate_sleep) == (
-                    [], [], []):
+            notifies = self.receive_notifications(self.simulate_sleep)
+            if not notifies:
                 logger.warning("Timeout in LISTEN")
-                if self.all_finished(timeslice):
-                    return
-            else:
-                conn.poll()
-                while conn.notifies:
-                    notify = conn.notifies.pop(0)
-                    logger.debug(
-                        "Process %d got end signal for process_id %d, "
-                        "timeslice %s", os.getpid(), notify.pid,
-                        notify.payload)
-                    if self.all_finished(timeslice):
-                        return
+            for notify in notifies:
+                logger.debug(
+                    "Process %d got notification on %r from process_id %d, "
+                    "payload %r", os.getpid(), notify.channel, notify.pid,
+                    notify.payload)
+            self.registry.commit()
+        self.registry.commit()
+        return time.time() - start
 
     def all_finished(self, timeslice):
         cls = self.__class__
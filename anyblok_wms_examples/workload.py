@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Examples project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""Reproducible generation of the simulated workload.
+
+Each worker gets its own random stream, derived from a global seed and
+its stream number, so that two runs with the same seed and scenario
+issue exactly the same sales, worker by worker. Of course, the
+interleaving of concurrent transactions can still differ.
+
+Scenarios are named sets of parameters for :class:`Workload`. Presets
+are in :data:`SCENARIOS`, and more can be loaded from JSON files with
+:func:`load_scenarios`.
+
+The workload can also be generated beforehand, as a feed file (see
+:func:`write_feed`), to be loaded in the database and replayed by the
+regular workers. Such files can as well be produced from captured
+traces, as long as they follow the same format.
+"""
+import bisect
+import csv
+import gzip
+import json
+import random
+
+SCENARIOS = {
+    'legacy': dict(
+        lines_weights=[1, 1, 1, 1],
+        quantity_weights=[1, 1],
+        zipf_exponent=0,
+    ),
+    'zipf': dict(
+        lines_weights=[1, 4, 3, 2],
+        quantity_weights=[6, 3, 1],
+        zipf_exponent=1,
+    ),
+    'hot': dict(
+        lines_weights=[0, 3, 1],
+        quantity_weights=[1],
+        zipf_exponent=1.5,
+    ),
+    'bulk': dict(
+        lines_weights=[0, 1, 2, 3, 3, 2, 1, 1, 1],
+        quantity_weights=[4, 3, 2, 1, 1],
+        zipf_exponent=0.8,
+    ),
+}
+"""Preset scenarios.
+
+- ``legacy``: same distributions as the original unseeded generator,
+  i.e., from 0 to 3 lines, uniform quantities of 1 or 2 and uniform
+  product popularity,
+- ``zipf``: mostly one or two lines, with Zipf product popularity,
+- ``hot``: a few very popular products, meant to stress contention,
+- ``bulk``: big sales, with a milder popularity skew.
+"""
+
+DEFAULT_SCENARIO = 'legacy'
+
+FEED_COLUMNS = ('timeslice', 'stream', 'kind', 'contents')
+"""Columns of feed files, which are CSV files with a header line.
+
+- ``timeslice``: starting from 1 for the first timeslice of the run,
+- ``stream``: the number of the regular worker that should process the row,
+- ``kind``: ``sale`` or ``purchase``,
+- ``contents``: JSON object whose keys are product codes, and values are
+  quantities. For purchases, quantities are numbers of packs.
+"""
+
+
+def load_scenarios(path):
+    """Add the scenarios of a JSON file to :data:`SCENARIOS`.
+
+    The file must contain an object whose keys are scenario names, and
+    values are keyword arguments for :class:`Workload`.
+
+    :return: names of the loaded scenarios
+    """
+    with open(path) as scen_file:
+        scenarios = json.load(scen_file)
+    SCENARIOS.update(scenarios)
+    return sorted(scenarios)
+
+
+def cumulate(weights):
+    """Cumulated weights, for :meth:`Workload.weighted_index`."""
+    cumulated = []
+    total = 0
+    for weight in weights:
+        total += weight
+        cumulated.append(total)
+    if not total:
+        raise ValueError("Weights %r are all zero" % (weights, ))
+    return cumulated
+
+
+class Workload:
+    """Seeded generator of sale contents.
+
+    :param seed: the global seed of the run, shared by all workers.
+                 If ``None``, the generator is not reproducible.
+    :param int stream: number of the random stream, typically the
+                       number of the worker
+    :param products: sequence of product codes. The order matters, since
+                     popularity is assigned by rank after a shuffle that
+                     depends only on ``seed``. If ``None``, it has to be
+                     set later on with :meth:`set_products`.
+    :param lines_weights: relative weights of the numbers of lines in a
+                          sale, starting from 0 line
+    :param quantity_weights: relative weights of quantities for a line,
+                             starting from 1
+    :param zipf_exponent: popularity of the product of rank ``r`` is
+                          proportional to ``1 / r ** zipf_exponent``.
+                          Zero means uniform popularity.
+    """
+
+    def __init__(self, seed=None, stream=0, products=None,
+                 lines_weights=(1, 1, 1, 1), quantity_weights=(1, 1),
+                 zipf_exponent=0):
+        self.seed = seed
+        self.stream = stream
+        self.rng = random.Random(
+            None if seed is None else '%s:%s' % (seed, stream))
+        self.lines_cumulated = cumulate(lines_weights)
+        self.quantity_cumulated = cumulate(quantity_weights)
+        self.zipf_exponent = zipf_exponent
+        self.products = None
+        if products is not None:
+            self.set_products(products)
+
+    @classmethod
+    def from_scenario(cls, name, seed=None, stream=0, products=None,
+                      **overrides):
+        """Instantiate from a scenario, see :data:`SCENARIOS`.
+
+        :raises: KeyError if there's no such scenario
+        """
+        params = dict(SCENARIOS[name])
+        params.update(overrides)
+        return cls(seed=seed, stream=stream, products=products, **params)
+
+    def set_products(self, products):
+        """Set the products and compute their popularity."""
+        ranked = list(products)
+        # all streams must agree on popularity ranks
+        random.Random(None if self.seed is None
+                      else '%s:popularity' % self.seed).shuffle(ranked)
+        self.products = ranked
+        self.products_cumulated = cumulate(
+            1 / (rank ** self.zipf_exponent)
+            for rank in range(1, len(ranked) + 1))
+
+    def weighted_index(self, cumulated):
+        """Draw an index according to the given cumulated weights."""
+        return bisect.bisect_right(cumulated,
+                                   self.rng.random() * cumulated[-1])
+
+    def product(self):
+        return self.products[self.weighted_index(self.products_cumulated)]
+
+    def sale_contents(self):
+        """Draw the contents of a sale.
+
+        :return: dict whose keys are product codes, and values quantities
+        """
+        contents = {}
+        for _ in range(self.weighted_index(self.lines_cumulated)):
+            product = self.product()
+            quantity = self.weighted_index(self.quantity_cumulated) + 1
+            contents[product] = contents.get(product, 0) + quantity
+        return contents
+
+    def purchase_contents(self, count):
+        """Draw the products of ``count`` packs to purchase.
+
+        Products are drawn according to their popularity, so that
+        replenishment roughly follows the demand.
+
+        :return: dict whose keys are product codes, and values numbers of
+                 packs
+        """
+        contents = {}
+        for _ in range(count):
+            product = self.product()
+            contents[product] = contents.get(product, 0) + 1
+        return contents
+
+    def randrange(self, *args):
+        """Same as :func:`random.randrange`, on our own stream."""
+        return self.rng.randrange(*args)
+
+
+def open_feed(path, mode='r'):
+    """Open a feed file, transparently (de)compressing if it ends in .gz"""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', newline='')
+    return open(path, mode, newline='')
+
+
+def feed_rows(workloads, timeslices, sales_per_timeslice,
+              purchases_per_timeslice=0):
+    """Generate the rows of a feed file.
+
+    :param workloads: :class:`Workload` instances, one per regular worker.
+                      Their stream numbers are used in the ``stream``
+                      column.
+    :param int purchases_per_timeslice: number of packs each worker
+                                        should purchase at the beginning of
+                                        each timeslice, on top of the ones
+                                        for missing products.
+    :return: iterable of tuples, following :data:`FEED_COLUMNS`
+    """
+    for timeslice in range(1, timeslices + 1):
+        for workload in workloads:
+            if purchases_per_timeslice:
+                yield (timeslice, workload.stream, 'purchase',
+                       workload.purchase_contents(purchases_per_timeslice))
+            for _ in range(sales_per_timeslice):
+                yield (timeslice, workload.stream, 'sale',
+                       workload.sale_contents())
+
+
+def write_feed(path, rows):
+    """Write a feed file, see :data:`FEED_COLUMNS` for the format.
+
+    :param rows: iterable of tuples, such as produced by :func:`feed_rows`
+    :return: number of written rows
+    """
+    count = 0
+    with open_feed(path, 'w') as feed_file:
+        writer = csv.writer(feed_file)
+        writer.writerow(FEED_COLUMNS)
+        for timeslice, stream, kind, contents in rows:
+            writer.writerow((timeslice, stream, kind,
+                             json.dumps(contents, sort_keys=True,
+                                        separators=(',', ':'))))
+            count += 1
+    return count
@@ -36,8 +36,16 @@ setup(
         ],
         'test_bloks': [
         ],
+        'anyblok.init': [
+            'wms_examples_config=anyblok_wms_examples:init_config',
+        ],
         'console_scripts': [
             'wms_example=anyblok_wms_examples.launcher.main:run',
+            'wms_example_stats=anyblok_wms_examples.launcher.stats:run',
+            'wms_example_feed=anyblok_wms_examples.launcher.feed:run',
+            'wms_example_seed=anyblok_wms_examples.launcher.seed:run',
+            ('wms_example_bench_compare='
+             'anyblok_wms_examples.basic.benchmarks.compare:run'),
         ],
     },
     include_package_data=True,